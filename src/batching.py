@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+from service_metrics import RollingStats
+
+
+class MicroBatcher:
+    """
+    Збирає одночасні запити в батч: чекає до window_ms від першого запиту
+    або поки не набереться max_batch_size, потім викликає run_batch над списком.
+
+    run_batch: async функція, що приймає список елементів і повертає
+    список результатів того ж розміру та порядку.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, window_ms=10.0, max_concurrent_batches=1):
+        self._run_batch = run_batch
+        self._max_batch_size = max(1, max_batch_size)
+        self._window = window_ms / 1000.0
+        self._max_concurrent_batches = max(1, max_concurrent_batches)
+
+        self._pending = []
+        self._wakeup = None
+        self._full = None
+        self._slots = None
+        self._task = None
+        self._running = set()
+
+        self.batch_sizes = RollingStats()
+        self.queue_delay_ms = RollingStats()
+        self.batch_latency_ms = RollingStats()
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._slots = asyncio.Semaphore(self._max_concurrent_batches)
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        for _, future, _ in self._pending:
+            if not future.done():
+                future.set_exception(RuntimeError("Планувальник батчів зупинено"))
+        self._pending.clear()
+
+    async def submit(self, item):
+        """
+        Ставить елемент у чергу й чекає на його результат з батчу.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future, time.perf_counter()))
+        self._wakeup.set()
+        if len(self._pending) >= self._max_batch_size:
+            self._full.set()
+        return await future
+
+    def metrics(self):
+        return {
+            "max_batch_size": self._max_batch_size,
+            "window_ms": self._window * 1000.0,
+            "queued": len(self._pending),
+            "batch_size": self.batch_sizes.summary(),
+            "queue_delay_ms": self.queue_delay_ms.summary(),
+            "batch_latency_ms": self.batch_latency_ms.summary(),
+        }
+
+    async def _loop(self):
+        while True:
+            await self._wakeup.wait()
+
+            # Вікно рахується від надходження найстаршого запиту в черзі
+            if len(self._pending) < self._max_batch_size:
+                remaining = self._pending[0][2] + self._window - time.perf_counter()
+                if remaining > 0:
+                    try:
+                        await asyncio.wait_for(self._full.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+
+            await self._slots.acquire()
+            batch = self._pending[:self._max_batch_size]
+            del self._pending[:self._max_batch_size]
+            if len(self._pending) < self._max_batch_size:
+                self._full.clear()
+            if not self._pending:
+                self._wakeup.clear()
+
+            task = asyncio.create_task(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch):
+        started = time.perf_counter()
+        self.batch_sizes.add(len(batch))
+        for _, _, enqueued in batch:
+            self.queue_delay_ms.add((started - enqueued) * 1000.0)
+
+        try:
+            results = await self._run_batch([item for item, _, _ in batch])
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.batch_latency_ms.add((time.perf_counter() - started) * 1000.0)
+            self._slots.release()
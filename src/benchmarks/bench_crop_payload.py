@@ -0,0 +1,82 @@
+import sys
+import json
+import time
+import base64
+import argparse
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import crop_frame
+
+
+def load_crops(crops_dir, count):
+    """
+    Сірі crop номерів з папки або синтетичні, якщо папку не задано.
+    """
+    if crops_dir:
+        files = sorted(Path(crops_dir).glob('*.*'))[:count]
+        crops = [cv2.imread(str(f), cv2.IMREAD_GRAYSCALE) for f in files]
+        return [c for c in crops if c is not None]
+
+    rng = np.random.default_rng(0)
+    crops = []
+    for _ in range(count):
+        crop = np.full((96, 420), 220, np.uint8)
+        cv2.putText(crop, "AA1234BB", (10, 75), cv2.FONT_HERSHEY_SIMPLEX, 2.4, 20, 6)
+        noise = rng.normal(0, 6, crop.shape)
+        crops.append(np.clip(crop + noise, 0, 255).astype(np.uint8))
+    return crops
+
+
+def json_payload(bboxes, crops):
+    # Як у yolo_server.extract_plate_crops: BGR JPEG у base64 всередині JSON
+    plate_crops = []
+    for bbox, gray in zip(bboxes, crops):
+        _, buffer = cv2.imencode('.jpg', cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR))
+        plate_crops.append({"bbox": bbox, "image": base64.b64encode(buffer).decode('utf-8')})
+    return json.dumps({"plate_crops": plate_crops}).encode('utf-8')
+
+
+def parse_json(body):
+    # Як у main_server.parse_yolo_response для JSON
+    return [base64.b64decode(c["image"]) for c in json.loads(body)["plate_crops"]]
+
+
+def parse_frame(body):
+    return crop_frame.unpack(body)
+
+
+def measure(parse, body, repeats):
+    started = time.process_time()
+    for _ in range(repeats):
+        parse(body)
+    return (time.process_time() - started) / repeats * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Розмір відповіді YOLO та CPU gateway на її розбір")
+    parser.add_argument("--crops-dir", help="Папка з crop номерів (інакше синтетичні)")
+    parser.add_argument("--crops", type=int, default=6, help="Кількість crop на відповідь")
+    parser.add_argument("--repeats", type=int, default=500)
+    args = parser.parse_args()
+
+    crops = load_crops(args.crops_dir, args.crops)
+    bboxes = [[0, 0, c.shape[1], c.shape[0]] for c in crops]
+
+    payloads = {
+        "json": (json_payload(bboxes, crops), parse_json),
+        "png": (crop_frame.pack(bboxes, crops, "png"), parse_frame),
+        "raw": (crop_frame.pack(bboxes, crops, "raw"), parse_frame),
+    }
+
+    print(f"{len(crops)} crop на відповідь, {args.repeats} повторів")
+    print(f"{'формат':<8}{'байт':>12}{'CPU розбору, мс':>20}")
+    for name, (body, parse) in payloads.items():
+        print(f"{name:<8}{len(body):>12}{measure(parse, body, args.repeats):>20.4f}")
+
+
+if __name__ == "__main__":
+    main()
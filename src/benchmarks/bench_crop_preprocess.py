@@ -0,0 +1,81 @@
+import sys
+import math
+import time
+import argparse
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import crop_preprocess
+
+
+def legacy_preprocess(img, bboxes):
+    # Попередній препроцесинг: 2x апскейл малих crop, новий CLAHE на кожен bbox, назад у BGR
+    crops = []
+    for x1, y1, x2, y2 in bboxes:
+        gray = cv2.cvtColor(img[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+        if gray.shape[0] < 80:
+            gray = cv2.resize(gray, (gray.shape[1] * 2, gray.shape[0] * 2), interpolation=cv2.INTER_CUBIC)
+        clahe = cv2.createCLAHE(clipLimit=1.5, tileGridSize=(8, 8))
+        crops.append(cv2.cvtColor(clahe.apply(gray), cv2.COLOR_GRAY2BGR))
+    return crops
+
+
+def legacy_batch(crops, shape):
+    # Повторний ресайз у розпізнавачі (RecResizeImg) для кожного crop
+    _, height, width = shape
+    max_width = max([width] + [int(height * c.shape[1] / c.shape[0]) for c in crops])
+    batch = np.zeros((len(crops), 3, height, max_width), np.float32)
+    for i, crop in enumerate(crops):
+        resized_w = min(max_width, int(math.ceil(height * crop.shape[1] / crop.shape[0])))
+        resized = cv2.resize(crop, (resized_w, height)).astype(np.float32)
+        batch[i, :, :, :resized_w] = (resized.transpose(2, 0, 1) / 255.0 - 0.5) / 0.5
+    return batch
+
+
+def synthetic_frame(plates, rng):
+    img = rng.integers(0, 255, (1080, 1920, 3), dtype=np.uint8)
+    bboxes = []
+    for i in range(plates):
+        w = int(rng.integers(60, 260))
+        h = max(12, w // 4)
+        x, y = 50 + i * 300 % 1600, 100 + (i * 170) % 900
+        cv2.rectangle(img, (x, y), (x + w, y + h), (230, 230, 230), -1)
+        cv2.putText(img, "AA1234BB", (x + 4, y + h - 4), cv2.FONT_HERSHEY_SIMPLEX, w / 260, (20, 20, 20), 2)
+        bboxes.append([x, y, x + w, y + h])
+    return img, bboxes
+
+
+def measure(fn, repeats):
+    fn()  # прогрів
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - started) / repeats * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Препроцесинг crop: попередній шлях проти crop_preprocess")
+    parser.add_argument("--plates", type=int, default=8, help="Номерів на кадр")
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    shape = crop_preprocess.DEFAULT_REC_IMAGE_SHAPE
+    img, bboxes = synthetic_frame(args.plates, np.random.default_rng(0))
+
+    legacy_ms = measure(lambda: legacy_batch(legacy_preprocess(img, bboxes), shape), args.repeats)
+    engine_ms = measure(
+        lambda: crop_preprocess.to_batch(crop_preprocess.preprocess_crops(img, bboxes, as_gray=True, shape=shape), shape),
+        args.repeats
+    )
+
+    print(f"{len(bboxes)} crop на кадр, {args.repeats} повторів, вхід розпізнавача {shape}")
+    print(f"{'шлях':<16}{'мс/кадр':>10}{'мс/crop':>10}")
+    for name, ms in (("попередній", legacy_ms), ("crop_preprocess", engine_ms)):
+        print(f"{name:<16}{ms:>10.3f}{ms / len(bboxes):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
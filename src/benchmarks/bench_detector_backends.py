@@ -0,0 +1,110 @@
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import pipeline
+from onnx_detector import OnnxDetector, export_onnx
+
+
+def load_images(images_dir, count):
+    files = sorted(Path(images_dir).glob('*.*'))[:count]
+    images = [(f.name, cv2.imread(str(f))) for f in files]
+    return [(name, img) for name, img in images if img is not None]
+
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union else 0.0
+
+
+def compare(reference, candidate, min_iou):
+    """
+    Чи збігаються bbox двох бекендів: однакова кількість і кожен bbox
+    еталону має пару з IoU не менше min_iou.
+    """
+    if len(reference) != len(candidate):
+        return False
+    unmatched = list(candidate)
+    for box in reference:
+        best = max(unmatched, key=lambda other: iou(box, other), default=None)
+        if best is None or iou(box, best) < min_iou:
+            return False
+        unmatched.remove(best)
+    return True
+
+
+def measure(predict, images, batch_size, repeats):
+    """
+    Середня затримка на зображення (мс) для батчів розміру batch_size.
+    """
+    predict(images[:batch_size])  # прогрів
+    timings = []
+    for _ in range(repeats):
+        for start in range(0, len(images), batch_size):
+            batch = images[start:start + batch_size]
+            started = time.perf_counter()
+            predict(batch)
+            timings.append((time.perf_counter() - started) * 1000.0 / len(batch))
+    return float(np.mean(timings)), float(np.percentile(timings, 95))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Збіг bbox і затримка YOLO: ultralytics (PyTorch) проти ONNX Runtime")
+    parser.add_argument("--images-dir", required=True, help="Папка з фіксованим набором фото")
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--model", default=pipeline.YOLO_MODEL_PATH)
+    parser.add_argument("--onnx", default=pipeline.YOLO_ONNX_PATH)
+    parser.add_argument("--min-iou", type=float, default=0.9)
+    parser.add_argument("--batch-sizes", default="1,4,8")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    from ultralytics import YOLO
+    if not Path(args.onnx).exists():
+        export_onnx(args.model, args.onnx)
+    torch_model = YOLO(args.model)
+    onnx_model = OnnxDetector(args.onnx)
+
+    def predict_torch(images):
+        results = torch_model(images, verbose=False, iou=pipeline.YOLO_IOU, conf=pipeline.YOLO_CONF)
+        return [[list(map(int, box.xyxy[0])) for box in result.boxes] for result in results]
+
+    def predict_onnx(images):
+        return [bboxes for bboxes, _ in onnx_model.detect(images, conf=pipeline.YOLO_CONF, iou=pipeline.YOLO_IOU)]
+
+    named = load_images(args.images_dir, args.count)
+    if not named:
+        print(f"Не знайдено зображень у '{args.images_dir}'")
+        sys.exit(2)
+    images = [img for _, img in named]
+
+    mismatches = []
+    for name, img in named:
+        reference, = predict_torch([img])
+        candidate, = predict_onnx([img])
+        if not compare(reference, candidate, args.min_iou):
+            mismatches.append((name, reference, candidate))
+
+    print(f"Збіг bbox: {len(named) - len(mismatches)}/{len(named)} зображень (IoU >= {args.min_iou})")
+    for name, reference, candidate in mismatches:
+        print(f"   {name}: ultralytics {reference} / onnx {candidate}")
+
+    print(f"{'бекенд':<14}{'батч':>6}{'мс/фото':>12}{'p95':>10}")
+    for batch_size in map(int, args.batch_sizes.split(",")):
+        for backend, predict in (("ultralytics", predict_torch), ("onnx", predict_onnx)):
+            mean, p95 = measure(predict, images, batch_size, args.repeats)
+            print(f"{backend:<14}{batch_size:>6}{mean:>12.2f}{p95:>10.2f}")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import cv2
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import pipeline
+from onnx_detector import OnnxDetector
+from onnx_recognizer import OnnxRecognizer
+from bench_detector_backends import iou
+
+# Перевірка перед промоушеном INT8 моделей: точність кандидата порівнюється з базовою моделлю,
+# і скрипт завершується з кодом 1, якщо падіння більше --max-drop.
+
+
+def load_recognizer(path):
+    if path.endswith(".onnx"):
+        return OnnxRecognizer(path, pipeline.OCR_MODEL_DIR)
+    from paddleocr import TextRecognition
+    return TextRecognition(model_name=pipeline.OCR_MODEL_NAME, model_dir=path)
+
+
+def load_detector(path):
+    if path.endswith(".onnx"):
+        model = OnnxDetector(path)
+        return lambda images: [bboxes for bboxes, _ in model.detect(images, conf=pipeline.YOLO_CONF, iou=pipeline.YOLO_IOU)]
+    from ultralytics import YOLO
+    model = YOLO(path)
+    return lambda images: [
+        [list(map(int, box.xyxy[0])) for box in result.boxes]
+        for result in model(images, verbose=False, iou=pipeline.YOLO_IOU, conf=pipeline.YOLO_CONF)
+    ]
+
+
+def load_labels(labels_path, root):
+    """
+    Розмітка у форматі PaddleOCR: "<шлях до crop>\\t<номер>" на рядок.
+    """
+    samples = []
+    with open(labels_path, encoding="utf-8") as f:
+        for line in f:
+            if "\t" not in line:
+                continue
+            rel_path, text = line.rstrip("\n").split("\t", 1)
+            img = cv2.imread(str(Path(root) / rel_path))
+            if img is not None:
+                crop, = pipeline.preprocess_plate_crops(img, [[0, 0, img.shape[1], img.shape[0]]])
+                samples.append((crop, pipeline.correct_plate_text(text)))
+    return samples
+
+
+def plate_accuracy(model, samples, batch_size):
+    """
+    Частка crop, для яких номер після correct_plate_text точно збігся з розміткою,
+    та затримка на crop (мс).
+    """
+    crops = [crop for crop, _ in samples]
+    started = time.perf_counter()
+    predictions = model.predict(crops, batch_size=batch_size)
+    elapsed = (time.perf_counter() - started) * 1000.0 / len(crops)
+
+    correct = 0
+    for rec, (crop, label) in zip(predictions, samples):
+        car = pipeline.build_car_result(pipeline.extract_fragments(rec), None)
+        if car and car["plate"] == label:
+            correct += 1
+    return correct / len(samples), elapsed
+
+
+def detector_agreement(baseline, candidate, images, min_iou):
+    """
+    Частка номерів базового детектора, які кандидат знайшов з IoU не менше min_iou,
+    та затримка кандидата на фото (мс).
+    """
+    found = total = 0
+    elapsed = 0.0
+    for img in images:
+        reference, = baseline([img])
+        started = time.perf_counter()
+        boxes, = candidate([img])
+        elapsed += time.perf_counter() - started
+        total += len(reference)
+        found += sum(1 for box in reference if any(iou(box, other) >= min_iou for other in boxes))
+    return (found / total if total else 1.0), elapsed * 1000.0 / len(images)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Точність INT8 моделей проти базових (гейт промоушену)")
+    parser.add_argument("--labels", help="Розмічені crop номерів (формат PaddleOCR)")
+    parser.add_argument("--labels-root", default=".", help="Відносно якої папки шляхи в --labels")
+    parser.add_argument("--baseline-recognizer", default=pipeline.OCR_MODEL_DIR,
+                        help="Папка моделі PaddlePaddle або ONNX файл")
+    parser.add_argument("--candidate-recognizer")
+    parser.add_argument("--photos-dir", help="Фото авто для перевірки детектора")
+    parser.add_argument("--photos-count", type=int, default=200)
+    parser.add_argument("--baseline-detector", default=pipeline.YOLO_MODEL_PATH, help=".pt або .onnx")
+    parser.add_argument("--candidate-detector")
+    parser.add_argument("--min-iou", type=float, default=0.5)
+    parser.add_argument("--max-drop", type=float, default=0.01, help="Допустиме падіння точності (частка)")
+    args = parser.parse_args()
+
+    failed = False
+
+    if args.candidate_recognizer:
+        samples = load_labels(args.labels, args.labels_root)
+        if not samples:
+            print("Немає розмічених crop для перевірки розпізнавача")
+            sys.exit(2)
+        base_acc, base_ms = plate_accuracy(load_recognizer(args.baseline_recognizer), samples, pipeline.OCR_BATCH_SIZE)
+        cand_acc, cand_ms = plate_accuracy(load_recognizer(args.candidate_recognizer), samples, pipeline.OCR_BATCH_SIZE)
+        drop = base_acc - cand_acc
+        print(f"Розпізнавач ({len(samples)} crop): точність {base_acc:.4f} -> {cand_acc:.4f}, "
+              f"{base_ms:.2f} -> {cand_ms:.2f} мс/crop (x{base_ms / cand_ms:.2f})")
+        if drop > args.max_drop:
+            print(f"   ПРОВАЛ: падіння {drop:.4f} > {args.max_drop}")
+            failed = True
+
+    if args.candidate_detector:
+        files = sorted(Path(args.photos_dir).glob('*.*'))[:args.photos_count]
+        images = [img for img in (cv2.imread(str(f)) for f in files) if img is not None]
+        if not images:
+            print(f"Не знайдено фото у '{args.photos_dir}'")
+            sys.exit(2)
+        baseline = load_detector(args.baseline_detector)
+        started = time.perf_counter()
+        for img in images:
+            baseline([img])
+        base_ms = (time.perf_counter() - started) * 1000.0 / len(images)
+        agreement, cand_ms = detector_agreement(baseline, load_detector(args.candidate_detector), images, args.min_iou)
+        print(f"Детектор ({len(images)} фото): знайдено {agreement:.4f} номерів базової моделі, "
+              f"{base_ms:.2f} -> {cand_ms:.2f} мс/фото (x{base_ms / cand_ms:.2f})")
+        if 1.0 - agreement > args.max_drop:
+            print(f"   ПРОВАЛ: втрачено {1.0 - agreement:.4f} > {args.max_drop}")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
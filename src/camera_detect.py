@@ -0,0 +1,40 @@
+from roi_masks import crop_to_roi, keep_in_roi
+
+# Детекція для кадру камери: пропуск нерухомих кадрів (MotionGate) і обрізка до зони
+# інтересу (ROI). Спільна для yolo_server і вбудованого режиму gateway: сервіси
+# передають свою корутину детекції та пул для CPU-роботи, тож логіка не розходиться.
+
+
+def check_motion(_, gate, source_id, img):
+    return gate.check(source_id, img)
+
+
+async def detect_gated(img, source_id, detect, gate, run_cpu):
+    """
+    Детекція з пропуском нерухомих кадрів камери source_id:
+    якщо сцена не змінилась, повертаються bbox попереднього кадру.
+
+    detect(img) — корутина, що повертає bbox; gate — MotionGate або None;
+    run_cpu(fn, *args) — виконує fn(None, *args) поза event loop.
+    """
+    if gate is None or not source_id:
+        return await detect(img)
+    bboxes, token = await run_cpu(check_motion, gate, source_id, img)
+    if bboxes is None:
+        bboxes = await detect(img)
+        gate.remember(source_id, token, bboxes)
+    return bboxes
+
+
+async def detect_in_roi(img, factor, source_id, detect, rois, gate, run_cpu):
+    """
+    Детекція лише в зоні інтересу камери: кадр (зменшений в factor разів) обрізається
+    до прямокутника навколо полігона, bbox поза полігоном відкидаються. Без ROI — весь кадр.
+    rois — {source_id: полігон}. Повертає bbox у координатах img.
+    """
+    polygon = rois.get(source_id) if source_id else None
+    if polygon is None:
+        return await detect_gated(img, source_id, detect, gate, run_cpu)
+    view, offset = crop_to_roi(img, polygon, factor)
+    bboxes = await detect_gated(view, source_id, detect, gate, run_cpu)
+    return keep_in_roi(bboxes, polygon, offset, factor)
@@ -0,0 +1,143 @@
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# Розмір перцептивного хешу: номер широкий, тож по горизонталі беремо більше точок,
+# щоб різні символи давали різні біти
+HASH_WIDTH = 48
+HASH_HEIGHT = 12
+# Поріг різниці яскравості: слабші перепади (шум, артефакти JPEG на фоні) не дають бітів
+HASH_GRADIENT_THRESHOLD = 16
+
+
+def dhash(img):
+    """
+    Різницевий хеш (dHash) crop з порогом: для кожної пари сусідніх пікселів
+    зменшеного сірого зображення два біти — "помітно світлішає" і "помітно темнішає".
+    Звичайний dHash бере знак навіть нульової різниці, і на однорідному фоні номера
+    шум перевертає більше бітів, ніж заміна одного символу.
+    Повертає 144 байти (1152 біти).
+    """
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (HASH_WIDTH + 1, HASH_HEIGHT), interpolation=cv2.INTER_AREA).astype(np.int16)
+    diff = small[:, 1:] - small[:, :-1]
+    bits = np.concatenate([
+        (diff > HASH_GRADIENT_THRESHOLD).ravel(),
+        (diff < -HASH_GRADIENT_THRESHOLD).ravel()
+    ])
+    return np.packbits(bits).tobytes()
+
+
+# Кількість одиничних бітів для кожного значення байта (для numpy без bitwise_count)
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], np.uint8)
+
+
+def hamming_distances(matrix, query):
+    """
+    Відстані Гемінга від query до кожного рядка matrix (обидва uint8).
+    """
+    if hasattr(np, "bitwise_count") and matrix.shape[1] % 8 == 0:
+        # numpy >= 2.0: апаратний popcount по 64-бітних словах
+        return np.bitwise_count(matrix.view(np.uint64) ^ query.view(np.uint64)).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT[matrix ^ query].sum(axis=1, dtype=np.int32)
+
+
+class CropCache:
+    """
+    Кеш результатів OCR за перцептивним хешем crop.
+
+    max_distance: допустима відстань Гемінга між хешами (0 = лише точний збіг).
+    Для 48x12 шум і повторне стиснення того ж crop дають до ~6 біт,
+    а заміна одного символу — від ~16, тож поріг варто тримати нижче цього.
+    min_confidence: результат зберігається, лише якщо всі фрагменти не менш упевнені.
+    Витіснення LRU при перевищенні max_entries.
+
+    Потокобезпечний; пошук найближчого коштує до ~1 мс на повному кеші,
+    тож lookup і store варто викликати з пулу потоків, а не з event loop.
+    """
+
+    def __init__(self, max_entries=4096, max_distance=6, min_confidence=0.9):
+        self._max_entries = max(1, max_entries)
+        self._max_distance = max_distance
+        self._min_confidence = min_confidence
+        # Хеш -> (рядок матриці, фрагменти)
+        self._entries = OrderedDict()
+        # Хеші записів у наперед виділеній матриці для векторизованого пошуку найближчого;
+        # store змінює лише один рядок
+        self._matrix = None
+        self._used = np.zeros(self._max_entries, bool)
+        self._row_keys = [None] * self._max_entries
+        self._free_rows = list(range(self._max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+        self._stats = {"hits_exact": 0, "hits_near": 0, "misses": 0, "stored": 0, "evictions": 0}
+
+    def lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits_exact"] += 1
+                return entry[1]
+
+            if self._max_distance > 0 and self._entries:
+                nearest = self._nearest(key)
+                if nearest is not None:
+                    self._entries.move_to_end(nearest)
+                    self._stats["hits_near"] += 1
+                    return self._entries[nearest][1]
+
+            self._stats["misses"] += 1
+            return None
+
+    def store(self, key, fragments):
+        if not fragments or min(f["confidence"] for f in fragments) < self._min_confidence:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], fragments)
+                self._entries.move_to_end(key)
+                return
+
+            if not self._free_rows:
+                _, (row, _) = self._entries.popitem(last=False)
+                self._used[row] = False
+                self._row_keys[row] = None
+                self._free_rows.append(row)
+                self._stats["evictions"] += 1
+            if self._matrix is None:
+                self._matrix = np.zeros((self._max_entries, len(key)), np.uint8)
+            row = self._free_rows.pop()
+            self._matrix[row] = np.frombuffer(key, np.uint8)
+            self._used[row] = True
+            self._row_keys[row] = key
+            self._entries[key] = (row, fragments)
+            self._stats["stored"] += 1
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            entries = len(self._entries)
+        hits = stats["hits_exact"] + stats["hits_near"]
+        lookups = hits + stats["misses"]
+        return {
+            **stats,
+            # Частка crop, для яких OCR не запускався
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "max_distance": self._max_distance,
+            "min_confidence": self._min_confidence,
+        }
+
+    def _nearest(self, key):
+        query = np.frombuffer(key, np.uint8)
+        if self._matrix is None or query.shape[0] != self._matrix.shape[1]:
+            return None
+        distances = hamming_distances(self._matrix, query)
+        distances[~self._used] = np.iinfo(np.int32).max
+        best = int(distances.argmin())
+        if distances[best] > self._max_distance:
+            return None
+        return self._row_keys[best]
@@ -0,0 +1,115 @@
+import json
+import struct
+import cv2
+import numpy as np
+
+# Бінарний формат crop замість base64 в JSON:
+#   MAGIC (4 байти) | довжина заголовка (uint32, big-endian) | JSON заголовок | дані crop підряд
+# Заголовок: {"crops": [{"bbox": [...], "encoding": "png"|"raw", "shape": [h, w], "size": n}, ...]}
+CONTENT_TYPE = "application/x-plate-crops"
+MAGIC = b"PLCR"
+ENCODINGS = ("png", "raw")
+
+_HEADER_PREFIX = struct.Struct(">4sI")
+
+
+def parse_accept(accept):
+    """
+    Повертає бажане кодування crop, якщо клієнт приймає бінарний формат, інакше None.
+    Приклад: "application/x-plate-crops; encoding=raw, application/json;q=0.5".
+    """
+    for part in (accept or "").split(","):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        if media_type != CONTENT_TYPE:
+            continue
+        encoding = "png"
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "encoding" and value.strip() in ENCODINGS:
+                encoding = value.strip()
+        return encoding
+    return None
+
+
+def encode_crop(gray, encoding):
+    if encoding == "raw":
+        return np.ascontiguousarray(gray).tobytes()
+    _, buffer = cv2.imencode('.png', gray)
+    return buffer.tobytes()
+
+
+def decode_crop(entry):
+    """
+    Відновлює сіре зображення crop з запису, отриманого з unpack().
+    """
+    if entry["encoding"] == "raw":
+        h, w = entry["shape"]
+        return np.frombuffer(entry["payload"], np.uint8).reshape(h, w)
+    return cv2.imdecode(np.frombuffer(entry["payload"], np.uint8), cv2.IMREAD_GRAYSCALE)
+
+
+def pack_entries(entries):
+    """
+    Збирає вже закодовані записи (bbox, encoding, shape, payload) в один кадр.
+    """
+    header = {"crops": [
+        {"bbox": e["bbox"], "encoding": e["encoding"], "shape": list(e["shape"]), "size": len(e["payload"])}
+        for e in entries
+    ]}
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    return b"".join(
+        [_HEADER_PREFIX.pack(MAGIC, len(header_bytes)), header_bytes]
+        + [e["payload"] for e in entries]
+    )
+
+
+def pack(bboxes, crops, encoding="png"):
+    """
+    Кодує сірі crop і пакує їх разом з bbox в один бінарний кадр.
+    """
+    return pack_entries([
+        {"bbox": bbox, "encoding": encoding, "shape": crop.shape[:2], "payload": encode_crop(crop, encoding)}
+        for bbox, crop in zip(bboxes, crops)
+    ])
+
+
+def unpack(data):
+    """
+    Розбирає кадр на записи без декодування зображень.
+    payload — memoryview на вихідні байти, тож записи можна перепакувати без копій кодеків.
+    Будь-який пошкоджений або обрізаний кадр дає ValueError.
+    """
+    if len(data) < _HEADER_PREFIX.size:
+        raise ValueError("Кадр crop обрізано")
+    magic, header_len = _HEADER_PREFIX.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("Невідомий формат кадру crop")
+    offset = _HEADER_PREFIX.size
+    if offset + header_len > len(data):
+        raise ValueError("Кадр crop обрізано")
+    header = json.loads(bytes(data[offset:offset + header_len]))
+    offset += header_len
+
+    view = memoryview(data)
+    entries = []
+    try:
+        for meta in header["crops"]:
+            size, encoding, shape = meta["size"], meta["encoding"], meta["shape"]
+            if not isinstance(size, int) or size < 0:
+                raise ValueError(f"Некоректний розмір crop: {size}")
+            if encoding not in ENCODINGS:
+                raise ValueError(f"Невідоме кодування crop: {encoding}")
+            if encoding == "raw" and int(shape[0]) * int(shape[1]) != size:
+                raise ValueError("Розмір raw crop не відповідає shape")
+            if offset + size > len(data):
+                raise ValueError("Кадр crop обрізано")
+            entries.append({
+                "bbox": meta["bbox"],
+                "encoding": encoding,
+                "shape": shape,
+                "payload": view[offset:offset + size],
+            })
+            offset += size
+    except (KeyError, TypeError, IndexError) as e:
+        raise ValueError(f"Некоректний заголовок кадру crop: {e}")
+    return entries
@@ -0,0 +1,105 @@
+import os
+import math
+import threading
+
+import cv2
+import numpy as np
+
+# Препроцесинг crop номерів під геометрію входу розпізнавача.
+# Crop одразу приводиться до висоти моделі (одне масштабування замість 2x апскейлу
+# тут і ще одного ресайзу в розпізнавачі), CLAHE створюється раз на потік.
+
+# Вхід розпізнавача за замовчуванням (RecResizeImg з inference.yml PP-OCRv5 rec)
+DEFAULT_REC_IMAGE_SHAPE = (3, 48, 320)
+
+CLAHE_CLIP_LIMIT = 1.5
+CLAHE_TILE_GRID = (8, 8)
+
+_local = threading.local()
+
+
+def load_rec_config(model_dir):
+    """
+    Читає з inference.yml розпізнавача розмір входу (RecResizeImg) і словник символів CTC.
+    Повертає (image_shape, characters).
+    """
+    import yaml
+    with open(os.path.join(model_dir, "inference.yml"), encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+
+    image_shape = DEFAULT_REC_IMAGE_SHAPE
+    for op in config.get("PreProcess", {}).get("transform_ops", []):
+        if isinstance(op, dict) and op.get("RecResizeImg"):
+            image_shape = tuple(op["RecResizeImg"]["image_shape"])
+    characters = [str(c) for c in config["PostProcess"]["character_dict"]]
+    return image_shape, characters
+
+
+def rec_image_shape(model_dir):
+    """
+    Геометрія входу розпізнавача з inference.yml або значення за замовчуванням,
+    якщо моделі на цьому вузлі немає (наприклад, у YOLO сервісі).
+    """
+    try:
+        return load_rec_config(model_dir)[0]
+    except (OSError, KeyError, ImportError):
+        return DEFAULT_REC_IMAGE_SHAPE
+
+
+def get_clahe():
+    # Об'єкти OpenCV не потокобезпечні, тож у кожного потоку пулу свій
+    clahe = getattr(_local, "clahe", None)
+    if clahe is None:
+        clahe = _local.clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=CLAHE_TILE_GRID)
+    return clahe
+
+
+def fit_height(img, height, max_width):
+    """
+    Одне масштабування до висоти моделі зі збереженням пропорцій;
+    ширші за max_width crop стискаються по горизонталі.
+    """
+    h, w = img.shape[:2]
+    width = max(1, min(max_width, int(math.ceil(height * w / h))))
+    if (h, w) == (height, width):
+        return img
+    interpolation = cv2.INTER_AREA if h > height else cv2.INTER_CUBIC
+    return cv2.resize(img, (width, height), interpolation=interpolation)
+
+
+def preprocess_crop(img, bbox, shape=DEFAULT_REC_IMAGE_SHAPE):
+    """
+    Вирізає bbox, переводить у сірий, вирівнює контраст (CLAHE)
+    і приводить до висоти входу розпізнавача. Повертає сірий uint8.
+    """
+    x1, y1, x2, y2 = bbox
+    crop = img[y1:y2, x1:x2]
+    gray = crop if crop.ndim == 2 else cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    gray = get_clahe().apply(gray)
+    _, height, width = shape
+    return fit_height(gray, height, width)
+
+
+def preprocess_crops(img, bboxes, as_gray=False, shape=DEFAULT_REC_IMAGE_SHAPE):
+    crops = [preprocess_crop(img, bbox, shape) for bbox in bboxes]
+    if as_gray:
+        return crops
+    return [cv2.cvtColor(crop, cv2.COLOR_GRAY2BGR) for crop in crops]
+
+
+def to_batch(crops, shape=DEFAULT_REC_IMAGE_SHAPE):
+    """
+    Збирає crop (сірі або BGR) в один масив (N, 3, висота, ширина) float32,
+    нормалізований до [-1, 1] і доповнений нулями праворуч, як RecResizeImg у PaddleOCR.
+    Crop, уже приведені preprocess_crop, не масштабуються вдруге.
+    """
+    channels, height, width = shape
+    batch = np.zeros((len(crops), channels, height, width), np.float32)
+    for i, crop in enumerate(crops):
+        fitted = fit_height(crop, height, width)
+        values = fitted.astype(np.float32) * (2.0 / 255.0) - 1.0
+        if values.ndim == 2:
+            batch[i, :, :, :values.shape[1]] = values
+        else:
+            batch[i, :, :, :values.shape[1]] = values.transpose(2, 0, 1)
+    return batch
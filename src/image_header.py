@@ -0,0 +1,83 @@
+import struct
+from collections import namedtuple
+
+# Формат і розміри зображення, прочитані із заголовка без декодування
+ImageHeader = namedtuple("ImageHeader", ["format", "width", "height"])
+
+MIME_TYPES = {
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "bmp": "image/bmp",
+    "webp": "image/webp",
+    "gif": "image/gif",
+}
+
+# Маркери JPEG SOF (Start Of Frame), що містять розміри кадру
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _sniff_jpeg(data):
+    offset = 2
+    size = len(data)
+    while offset + 4 <= size:
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        # Заповнювачі 0xFF між маркерами
+        if marker == 0xFF:
+            offset += 1
+            continue
+        # Маркери без довжини
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        segment_len, = struct.unpack_from(">H", data, offset + 2)
+        if marker in _JPEG_SOF_MARKERS:
+            if offset + 9 > size:
+                return None
+            height, width = struct.unpack_from(">HH", data, offset + 5)
+            return ImageHeader("jpeg", width, height)
+        # SOS: далі йдуть стиснені дані, SOF вже мав бути
+        if marker == 0xDA:
+            return None
+        offset += 2 + segment_len
+    return None
+
+
+def _sniff_webp(data):
+    chunk = data[12:16]
+    if chunk == b"VP8 " and len(data) >= 30:
+        width, height = struct.unpack_from("<HH", data, 26)
+        return ImageHeader("webp", width & 0x3FFF, height & 0x3FFF)
+    if chunk == b"VP8L" and len(data) >= 25:
+        bits, = struct.unpack_from("<I", data, 21)
+        return ImageHeader("webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+    if chunk == b"VP8X" and len(data) >= 30:
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return ImageHeader("webp", width, height)
+    return None
+
+
+def sniff(data):
+    """
+    Визначає формат і розміри зображення за першими байтами.
+    Повертає ImageHeader або None, якщо формат невідомий чи заголовок пошкоджений.
+    """
+    try:
+        if data[:3] == b"\xff\xd8\xff":
+            return _sniff_jpeg(data)
+        if data[:8] == b"\x89PNG\r\n\x1a\n" and data[12:16] == b"IHDR":
+            width, height = struct.unpack_from(">II", data, 16)
+            return ImageHeader("png", width, height)
+        if data[:2] == b"BM" and len(data) >= 26:
+            width, height = struct.unpack_from("<ii", data, 18)
+            return ImageHeader("bmp", width, abs(height))
+        if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            return _sniff_webp(data)
+        if data[:6] in (b"GIF87a", b"GIF89a"):
+            width, height = struct.unpack_from("<HH", data, 6)
+            return ImageHeader("gif", width, height)
+    except struct.error:
+        return None
+    return None
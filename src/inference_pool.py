@@ -0,0 +1,75 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class InferencePool:
+    """
+    Пул потоків для блокуючої роботи (інференс, кодування зображень),
+    щоб вона не зупиняла event loop uvicorn.
+
+    Предиктори ultralytics та Paddle не можна ділити між потоками,
+    тому кожен потік отримує власний екземпляр моделі з loader().
+    Без loader пул підходить для роботи без моделі (cv2.imdecode тощо).
+
+    preloaded: вже завантажена модель (наприклад, успадкована від батьківського
+    процесу при fork); її отримує перший потік замість виклику loader().
+    """
+
+    def __init__(self, loader=None, workers=1, name="inference", preloaded=None):
+        self._loader = loader
+        self._workers = max(1, workers)
+        self._local = threading.local()
+        self._preloaded = preloaded
+        self._preloaded_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._workers,
+            thread_name_prefix=name
+        )
+
+    @property
+    def workers(self):
+        return self._workers
+
+    def start(self):
+        """
+        Завантажує модель у кожному потоці пулу заздалегідь,
+        щоб перший запит не чекав на завантаження.
+        """
+        if self._loader is None:
+            return
+        # Бар'єр тримає кожне завдання у своєму потоці, доки всі не завантажаться
+        barrier = threading.Barrier(self._workers)
+
+        def warm_up():
+            try:
+                self._get_model()
+            finally:
+                barrier.wait()
+
+        futures = [self._executor.submit(warm_up) for _ in range(self._workers)]
+        for future in futures:
+            future.result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    async def run(self, fn, *args):
+        """
+        Виконує fn(model, *args) у потоці пулу та повертає результат.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, fn, args)
+
+    def _get_model(self):
+        model = getattr(self._local, "model", None)
+        if model is None and self._loader is not None:
+            with self._preloaded_lock:
+                model, self._preloaded = self._preloaded, None
+            if model is None:
+                model = self._loader()
+            self._local.model = model
+        return model
+
+    def _call(self, fn, args):
+        return fn(self._get_model(), *args)
@@ -1,48 +1,742 @@
+import os
+import json
+import time
+import asyncio
+import importlib.util
 import uvicorn
 import cv2
 import numpy as np
-import re
+import base64
 import httpx
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Body, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-# URLs мікросервісів
-YOLO_SERVICE_URL = "http://localhost:8001/detect_plates"
-OCR_SERVICE_URL = "http://localhost:8002/recognize_text"
+from inference_pool import InferencePool
+import shm_transport
+import crop_frame
+import image_header
+import pipeline
+import stream_ingest
+from result_cache import ResultCache, content_key
+from singleflight import SingleFlight
+from service_metrics import RollingStats
+from motion_gate import MotionGate, MOTION_GATE_ENABLED
+from roi_masks import load_rois
+import camera_detect
 
-app = FastAPI()
+# Бекенд gateway: "http" — YOLO та OCR мікросервіси, "local" — обидві моделі в цьому процесі
+GATEWAY_BACKEND = os.getenv("GATEWAY_BACKEND", "http")
+
+def service_endpoint(service_url, path):
+    """
+    URL іншого ендпоінта того ж сервісу: схема, хост і порт беруться з service_url.
+    """
+    return str(httpx.URL(service_url).copy_with(path=path, query=None))
+
+
+# URLs мікросервісів. Додаткові ендпоінти за замовчуванням будуються від основного URL
+# сервісу, тож для віддаленого сервісу достатньо задати YOLO_SERVICE_URL / OCR_SERVICE_URL
+YOLO_SERVICE_URL = os.getenv("YOLO_SERVICE_URL", "http://localhost:8001/detect_plates")
+OCR_SERVICE_URL = os.getenv("OCR_SERVICE_URL", "http://localhost:8002/recognize_text")
+OCR_BATCH_SERVICE_URL = os.getenv("OCR_BATCH_SERVICE_URL") or service_endpoint(OCR_SERVICE_URL, "/recognize_text_batch")
+YOLO_SHM_SERVICE_URL = os.getenv("YOLO_SHM_SERVICE_URL") or service_endpoint(YOLO_SERVICE_URL, "/detect_plates_shm")
+OCR_FRAME_SERVICE_URL = os.getenv("OCR_FRAME_SERVICE_URL") or service_endpoint(OCR_SERVICE_URL, "/recognize_text_frame")
+OCR_SHM_SERVICE_URL = os.getenv("OCR_SHM_SERVICE_URL") or service_endpoint(OCR_SERVICE_URL, "/recognize_text_shm")
+
+# Передача кадрів через спільну пам'ять: "auto" — лише якщо сервіси на цьому ж вузлі,
+# "on" — завжди, "off" — тільки HTTP
+SHM_TRANSPORT = os.getenv("SHM_TRANSPORT", "auto")
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+# Формат crop від YOLO сервісу: "png"/"raw" — бінарний кадр crop_frame, "json" — base64 в JSON
+YOLO_CROP_FORMAT = os.getenv("YOLO_CROP_FORMAT", "png")
+
+# Прийом завантажень: "passthrough" — пересилати оригінальні байти без декодування,
+# якщо YOLO сервіс читає цей формат; "transcode" — завжди декодувати і перекодувати в JPEG
+INGEST_MODE = os.getenv("INGEST_MODE", "passthrough")
+PASSTHROUGH_FORMATS = set(os.getenv("PASSTHROUGH_FORMATS", "jpeg,png,bmp,webp").split(","))
+
+# Unix-сокети для сервісів на тому ж вузлі (порожньо = звичайний TCP)
+YOLO_SERVICE_UDS = os.getenv("YOLO_SERVICE_UDS", "")
+OCR_SERVICE_UDS = os.getenv("OCR_SERVICE_UDS", "")
+
+# Параметри пулу з'єднань
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30.0"))
+# Сегменти спільної пам'яті, старші за це (секунди), вважаються покинутими і видаляються
+SHM_SEGMENT_TTL = float(os.getenv("SHM_SEGMENT_TTL", str(max(60.0, 2 * HTTP_TIMEOUT))))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60.0"))
+# HTTP/2 діє лише для https:// URL сервісів: httpx не підтримує HTTP/2 без TLS (h2c),
+# тож для http:// з'єднання лишаються HTTP/1.1 з keep-alive
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1") == "1"
+
+# Обмеження паралельних OCR запитів: на один /detect та на весь процес
+OCR_REQUEST_CONCURRENCY = int(os.getenv("OCR_REQUEST_CONCURRENCY", "4"))
+OCR_GLOBAL_CONCURRENCY = int(os.getenv("OCR_GLOBAL_CONCURRENCY", "32"))
+
+# Скільки crop відправляти одним запитом на /recognize_text_batch (1 = по одному)
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "8"))
+
+# Потоки для декодування/кодування зображень поза event loop
+CODEC_WORKERS = int(os.getenv("CODEC_WORKERS", "4"))
+
+# Потоки інференсу для бекенду "local" (кожен з власними копіями моделей)
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+
+# Кеш результатів /detect за хешем вмісту (RESULT_CACHE_MAX_MB=0 вимикає)
+RESULT_CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", "64"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "600"))
+# Папка для дискового рівня кешу (порожньо = лише пам'ять)
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "")
+
+# Трекінг номерів у /detect_stream за замовчуванням (лише локальний бекенд)
+STREAM_TRACKING = os.getenv("STREAM_TRACKING", "1") == "1"
+
+# WebSocket /ws/detect: скільки кадрів одного з'єднання обробляються одночасно
+# (наступний кадр не читається, поки не звільниться місце)
+WS_MAX_IN_FLIGHT = int(os.getenv("WS_MAX_IN_FLIGHT", "4"))
+
+# Один запуск конвеєра на однакові одночасні завантаження (ретраї клієнтів)
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "1") == "1"
+
+# --- ГЛОБАЛЬНІ ЗМІННІ ---
+clients = {}
+limiters = {}
+pools = {}
+caches = {}
+flights = {}
+gates = {}
+rois = {}
+tasks = {}
+transport_state = {"shm_available": True, "ocr_frame_available": True, "ocr_batch_available": True}
+# Розмір відповіді YOLO та CPU gateway на її розбір для кожного формату crop
+yolo_payload_bytes = {"json": RollingStats(), "png": RollingStats(), "raw": RollingStats()}
+yolo_parse_cpu_ms = {"json": RollingStats(), "png": RollingStats(), "raw": RollingStats()}
+# WebSocket: відкриті з'єднання та час від отримання кадру до відправки результату (мс)
+ws_state = {"connections": 0}
+ws_frame_ms = RollingStats()
+
+
+def build_http_client():
+    """
+    Створює єдиний клієнт з пулом з'єднань на весь час життя застосунку.
+    Для сервісів з заданим UDS шляхом запити йдуть через Unix-сокет.
+    """
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    # HTTP/2 лише якщо встановлено пакет h2 (httpx[http2]) і лише для https:// сервісів
+    http2 = HTTP2_ENABLED and importlib.util.find_spec("h2") is not None
+
+    mounts = {}
+    for url, uds in ((YOLO_SERVICE_URL, YOLO_SERVICE_UDS), (OCR_SERVICE_URL, OCR_SERVICE_UDS)):
+        if not uds:
+            continue
+        parsed = httpx.URL(url)
+        origin = f"{parsed.scheme}://{parsed.host}" + (f":{parsed.port}" if parsed.port else "")
+        mounts[origin] = httpx.AsyncHTTPTransport(uds=uds, limits=limits)
+
+    return httpx.AsyncClient(
+        timeout=HTTP_TIMEOUT,
+        limits=limits,
+        http2=http2,
+        mounts=mounts or None,
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    clients["http"] = build_http_client()
+    limiters["ocr"] = asyncio.Semaphore(OCR_GLOBAL_CONCURRENCY)
+    pools["codec"] = InferencePool(workers=CODEC_WORKERS, name="codec")
+    print("HTTP клієнт мікросервісів створено.")
+
+    if GATEWAY_BACKEND == "local":
+        print("Завантаження YOLO та OCR моделей у gateway...")
+        pools["yolo"] = InferencePool(pipeline.load_yolo, workers=INFERENCE_WORKERS, name="yolo")
+        pools["ocr"] = InferencePool(pipeline.load_ocr, workers=INFERENCE_WORKERS, name="ocr")
+        try:
+            pools["yolo"].start()
+            pools["ocr"].start()
+            print("Моделі успішно завантажено.")
+        except Exception as e:
+            print(f"Помилка завантаження моделей: {e}")
+        if MOTION_GATE_ENABLED:
+            gates["motion"] = MotionGate()
+        try:
+            rois.update(load_rois())
+        except (OSError, ValueError) as e:
+            print(f"Помилка завантаження зон інтересу: {e}")
+
+    if RESULT_CACHE_MAX_MB > 0:
+        caches["result"] = ResultCache(
+            max_bytes=int(RESULT_CACHE_MAX_MB * 1024 * 1024),
+            ttl=RESULT_CACHE_TTL,
+            disk_dir=RESULT_CACHE_DIR or None
+        )
+        if RESULT_CACHE_DIR:
+            tasks["prune"] = asyncio.create_task(prune_result_cache(caches["result"]))
+    if SINGLEFLIGHT_ENABLED:
+        flights["detect"] = SingleFlight()
+    if GATEWAY_BACKEND != "local" and SHM_TRANSPORT != "off":
+        tasks["prune_shm"] = asyncio.create_task(prune_shm_segments())
+
+    yield
+
+    for task in tasks.values():
+        task.cancel()
+    tasks.clear()
+    caches.clear()
+    flights.clear()
+    gates.clear()
+    rois.clear()
+    await clients["http"].aclose()
+    clients.clear()
+    limiters.clear()
+    for pool in pools.values():
+        pool.shutdown()
+    pools.clear()
+
+
+async def prune_result_cache(cache):
+    """
+    Періодично видаляє прострочені записи дискового рівня кешу.
+    """
+    while True:
+        await asyncio.sleep(RESULT_CACHE_TTL)
+        removed = await asyncio.to_thread(cache.prune_disk)
+        if removed:
+            print(f"Кеш результатів: видалено {removed} прострочених записів з диска.")
+
+
+async def prune_shm_segments():
+    """
+    Періодично видаляє покинуті сегменти спільної пам'яті: crop, які YOLO сервіс записав
+    для запиту, що вже завершився тайм-аутом, або сегменти процесів, що впали.
+    """
+    while True:
+        await asyncio.sleep(SHM_SEGMENT_TTL / 2)
+        removed = await asyncio.to_thread(shm_transport.prune, SHM_SEGMENT_TTL)
+        if removed:
+            print(f"Спільна пам'ять: видалено {removed} покинутих сегментів.")
+
+
+app = FastAPI(lifespan=lifespan)
 
 # --- ДОПОМІЖНІ ФУНКЦІЇ ---
 
-def correct_plate_text(text):
-    allowed_letters = 'ABCEHIKMOPTXDUY'
-    standard_pattern = fr'^\[{allowed_letters}\]{{2}}\\d{{4}}\[{allowed_letters}\]{{2}}$'
-    text = text.replace(' ', '').replace('-', '').upper()
-    if not text or len(text) < 3:
-        return ""
-    chars = list(text)
-    if len(chars) == 8:
-        for i in [0, 1, 6, 7]:  # літери
-            if chars[i] == '0': chars[i] = 'O'
-            if chars[i] == '1': chars[i] = 'I'
-            if chars[i] == '8': chars[i] = 'B'
-        for i in range(2, 6):  # цифри
-            if chars[i] == 'O': chars[i] = '0'
-            if chars[i] == 'I': chars[i] = '1'
-            if chars[i] == 'B': chars[i] = '8'
-    text = ''.join(chars)
-    if re.match(standard_pattern, text):
-        return text
-    return text if len(text) >= 5 else ""
+async def recognize_crop(client, crop_data, request_limit):
+    """
+    Відправляє один crop в OCR сервіс з урахуванням обох лімітів.
+    Повертає (fragments, None) або (None, опис помилки).
+    """
+    async with request_limit, limiters["ocr"]:
+        try:
+            ocr_response = await client.post(
+                OCR_SERVICE_URL,
+                files={"file": ("crop.jpg", crop_data["jpeg"], "image/jpeg")}
+            )
+        except httpx.HTTPError as e:
+            return None, f"OCR недоступний: {e}"
+
+    if ocr_response.status_code != 200:
+        return None, f"Помилка OCR сервісу: HTTP {ocr_response.status_code}"
+    return ocr_response.json().get("fragments", []), None
+
+
+async def recognize_crop_batch(client, batch, request_limit):
+    """
+    Відправляє кілька crop одним запитом на batch ендпоінт OCR сервісу.
+    Повертає список (fragments, error) у порядку crop.
+    """
+    files = [
+        ("files", (f"crop_{i}.jpg", crop_data["jpeg"], "image/jpeg"))
+        for i, crop_data in enumerate(batch)
+    ]
+    async with request_limit, limiters["ocr"]:
+        try:
+            ocr_response = await client.post(OCR_BATCH_SERVICE_URL, files=files)
+        except httpx.HTTPError as e:
+            return [(None, f"OCR недоступний: {e}")] * len(batch)
+
+    if ocr_response.status_code == 404:
+        # Стара версія OCR сервісу без batch ендпоінта: по одному crop
+        disable_batch_transport(f"OCR HTTP {ocr_response.status_code}")
+        return await asyncio.gather(*(
+            recognize_crop(client, crop_data, request_limit)
+            for crop_data in batch
+        ))
+    return parse_batch_results(ocr_response, len(batch))
+
+
+def disable_batch_transport(reason):
+    if transport_state["ocr_batch_available"]:
+        print(f"Batch ендпоінт OCR недоступний ({reason}), перехід на запити по одному crop.")
+    transport_state["ocr_batch_available"] = False
+
+
+async def recognize_crop_frame(client, batch, request_limit):
+    """
+    Пересилає crop у бінарному форматі crop_frame на OCR сервіс як є,
+    без декодування та перекодування в gateway.
+    """
+    body = crop_frame.pack_entries([crop_data["entry"] for crop_data in batch])
+    async with request_limit, limiters["ocr"]:
+        try:
+            ocr_response = await client.post(
+                OCR_FRAME_SERVICE_URL,
+                content=body,
+                headers={"Content-Type": crop_frame.CONTENT_TYPE}
+            )
+        except httpx.HTTPError as e:
+            return [(None, f"OCR недоступний: {e}")] * len(batch)
+
+    if ocr_response.status_code in (404, 415):
+        # Стара версія OCR сервісу без бінарного ендпоінта: ті самі crop через JPEG
+        disable_frame_transport(f"OCR HTTP {ocr_response.status_code}")
+        await attach_jpeg(batch)
+        return await recognize_crop_batch(client, batch, request_limit)
+    return parse_batch_results(ocr_response, len(batch))
+
+
+def disable_frame_transport(reason):
+    if transport_state["ocr_frame_available"]:
+        print(f"Бінарний ендпоінт OCR недоступний ({reason}), перехід на JPEG batch.")
+    transport_state["ocr_frame_available"] = False
+
+
+def encode_frame_crops(_, entries):
+    """
+    Декодує crop з кадру crop_frame і кодує їх у JPEG для batch ендпоінта OCR.
+    """
+    return [cv2.imencode('.jpg', crop_frame.decode_crop(entry))[1].tobytes() for entry in entries]
+
+
+async def attach_jpeg(plate_crops):
+    encoded = await pools["codec"].run(encode_frame_crops, [crop_data["entry"] for crop_data in plate_crops])
+    for crop_data, jpeg in zip(plate_crops, encoded):
+        crop_data["jpeg"] = jpeg
+
+
+def parse_batch_results(ocr_response, count):
+    """
+    Розбирає відповідь batch ендпоінтів OCR у список (fragments, error) рівно з count записів:
+    crop, для яких сервіс не повернув результату, отримують явну помилку.
+    """
+    if ocr_response.status_code != 200:
+        return [(None, f"Помилка OCR сервісу: HTTP {ocr_response.status_code}")] * count
+    results = [
+        (item.get("fragments", []), item.get("error"))
+        for item in ocr_response.json().get("results", [])[:count]
+    ]
+    missing = count - len(results)
+    return results + [(None, "OCR сервіс не повернув результат для crop")] * missing
+
+
+async def recognize_crops(client, plate_crops):
+    """
+    Розпізнає всі crop паралельно: батчами або по одному залежно від OCR_BATCH_SIZE.
+    Порядок результатів відповідає порядку plate_crops.
+    """
+    request_limit = asyncio.Semaphore(OCR_REQUEST_CONCURRENCY)
+    binary = bool(plate_crops) and "entry" in plate_crops[0]
+    if binary and not transport_state["ocr_frame_available"]:
+        await attach_jpeg(plate_crops)
+        binary = False
+    if (OCR_BATCH_SIZE <= 1 or not transport_state["ocr_batch_available"]) and not binary:
+        return await asyncio.gather(*(
+            recognize_crop(client, crop_data, request_limit)
+            for crop_data in plate_crops
+        ))
+
+    batch_size = max(1, OCR_BATCH_SIZE)
+    batches = [
+        plate_crops[i:i + batch_size]
+        for i in range(0, len(plate_crops), batch_size)
+    ]
+    send_batch = recognize_crop_frame if binary else recognize_crop_batch
+    batch_results = await asyncio.gather(*(
+        send_batch(client, batch, request_limit)
+        for batch in batches
+    ))
+    return [result for results in batch_results for result in results]
+
+def reencode_image(_, contents):
+    """
+    Декодує завантаження і перекодовує в JPEG для YOLO сервісу.
+    Повертає None, якщо це не зображення.
+    """
+    nparr = np.frombuffer(contents, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    _, img_encoded = cv2.imencode('.jpg', img)
+    return img_encoded.tobytes()
+
+def preprocess_crops(_, img, bboxes):
+    return pipeline.preprocess_plate_crops(img, bboxes)
+
+
+def decode_for_detection(_, contents):
+    return pipeline.decode_for_detection(contents)
+
+
+def decode_full_crops(_, contents, bboxes, factor):
+    """
+    Повне декодування в сірому, переведення bbox зі зменшеного кадру та препроцесинг crop.
+    """
+    img = pipeline.decode_for_crops(contents)
+    if img is None:
+        return None, None
+    bboxes = pipeline.scale_bboxes(bboxes, factor, img.shape)
+    return bboxes, pipeline.preprocess_plate_crops(img, bboxes)
+
+
+def write_shm_frame(_, img):
+    return shm_transport.write_arrays([img])
+
+
+def write_full_crops(_, contents, bboxes, factor):
+    """
+    Crop з повного декодування для bbox, знайдених на зменшеному кадрі,
+    у новому сегменті спільної пам'яті. Повертає (bboxes, handle).
+    """
+    bboxes, crops = decode_full_crops(_, contents, bboxes, factor)
+    if bboxes is None:
+        return None, None
+    return bboxes, shm_transport.write_arrays(crops)
+
+
+def encode_shm_crops(_, handle):
+    """
+    Читає crop зі спільної пам'яті та кодує їх у JPEG для HTTP шляху OCR.
+    """
+    encoded = []
+    for crop in shm_transport.read_arrays(handle):
+        _, buffer = cv2.imencode('.jpg', crop)
+        encoded.append(buffer.tobytes())
+    return encoded
+
+
+def parse_yolo_response(yolo_response):
+    """
+    Розбирає відповідь YOLO (бінарний кадр crop або JSON з base64)
+    у список crop з bbox та даними для OCR. Записує розмір і CPU розбору.
+    """
+    started = time.thread_time()
+    content_type = yolo_response.headers.get("content-type", "").split(";")[0].strip()
+    if content_type == crop_frame.CONTENT_TYPE:
+        entries = crop_frame.unpack(yolo_response.content)
+        plate_crops = [{"bbox": entry["bbox"], "entry": entry} for entry in entries]
+        payload_format = entries[0]["encoding"] if entries else YOLO_CROP_FORMAT
+    else:
+        plate_crops = [
+            {"bbox": crop_data["bbox"], "jpeg": base64.b64decode(crop_data["image"])}
+            for crop_data in yolo_response.json().get("plate_crops", [])
+        ]
+        payload_format = "json"
+    
+    if payload_format in yolo_parse_cpu_ms:
+        yolo_parse_cpu_ms[payload_format].add((time.thread_time() - started) * 1000.0)
+        yolo_payload_bytes[payload_format].add(len(yolo_response.content))
+    return plate_crops
+
+
+def is_local_service(url, uds):
+    return bool(uds) or httpx.URL(url).host in LOCAL_HOSTS
+
+
+def use_shm_transport():
+    if SHM_TRANSPORT == "on":
+        return True
+    if SHM_TRANSPORT != "auto" or not transport_state["shm_available"]:
+        return False
+    return (is_local_service(YOLO_SHM_SERVICE_URL, YOLO_SERVICE_UDS)
+            and is_local_service(OCR_SHM_SERVICE_URL, OCR_SERVICE_UDS))
+
+
+def disable_shm_transport(reason):
+    if transport_state["shm_available"]:
+        print(f"Спільна пам'ять недоступна ({reason}), перехід на HTTP.")
+    transport_state["shm_available"] = False
+
+
+async def detect_via_http(client, contents, source_id=None):
+    """
+    YOLO → OCR через HTTP.
+    Повертає (plate_crops, ocr_results).
+    """
+    header = image_header.sniff(contents)
+    if INGEST_MODE == "passthrough" and header and header.format in PASSTHROUGH_FORMATS:
+        # Заголовок валідний і формат зрозумілий YOLO сервісу: байти йдуть без змін
+        img_bytes = contents
+        filename = f"image.{header.format}"
+        media_type = image_header.MIME_TYPES[header.format]
+    else:
+        # Декодування та кодування для відправки (у пулі потоків)
+        img_bytes = await pools["codec"].run(reencode_image, contents)
+        filename, media_type = "image.jpg", "image/jpeg"
+    
+    if img_bytes is None:
+        raise HTTPException(status_code=400, detail="Не вдалося декодувати зображення")
+    
+    # 1. Відправка в YOLO сервіс
+    headers = {}
+    if YOLO_CROP_FORMAT in crop_frame.ENCODINGS:
+        # JSON лишається запасним варіантом для старих версій YOLO сервісу
+        headers["Accept"] = f"{crop_frame.CONTENT_TYPE}; encoding={YOLO_CROP_FORMAT}, application/json;q=0.5"
+    yolo_response = await client.post(
+        YOLO_SERVICE_URL,
+        files={"file": (filename, img_bytes, media_type)},
+        data={"source_id": source_id} if source_id else None,
+        headers=headers
+    )
+    
+    if yolo_response.status_code == 400:
+        # Заголовок був валідний, але саме зображення YOLO сервіс декодувати не зміг
+        raise HTTPException(status_code=400, detail="Не вдалося декодувати зображення")
+    if yolo_response.status_code != 200:
+        raise HTTPException(status_code=500, detail="Помилка YOLO сервісу")
+    
+    plate_crops = parse_yolo_response(yolo_response)
+    
+    # 2. Паралельна відправка всіх crop в OCR сервіс
+    return plate_crops, await recognize_crops(client, plate_crops)
+
+
+async def detect_via_shm(client, contents, source_id=None):
+    """
+    YOLO → OCR через спільну пам'ять: кадр декодується тут (для JPEG — зменшений,
+    як у YOLO сервісі), сервіси обмінюються лише handle сегментів.
+    Після детекції на зменшеному кадрі crop вирізає gateway з повного декодування.
+    Повертає (plate_crops, ocr_results) або None, якщо треба перейти на HTTP.
+    """
+    img, factor = await pools["codec"].run(decode_for_detection, contents)
+    if img is None:
+        raise HTTPException(status_code=400, detail="Не вдалося декодувати зображення")
+    
+    try:
+        frame = await pools["codec"].run(write_shm_frame, img)
+    except OSError as e:
+        disable_shm_transport(e)
+        return None
+    
+    crops = None
+    try:
+        # 1. YOLO читає кадр зі спільної пам'яті
+        try:
+            yolo_response = await client.post(
+                YOLO_SHM_SERVICE_URL,
+                json={"frame": frame, "source_id": source_id, "factor": factor}
+            )
+        except httpx.HTTPError as e:
+            # Сервіс за URL спільної пам'яті недоступний: далі звичайний HTTP шлях
+            disable_shm_transport(f"YOLO недоступний: {e}")
+            return None
+        if yolo_response.status_code in (403, 404, 422):
+            disable_shm_transport(f"YOLO HTTP {yolo_response.status_code}")
+            return None
+        if yolo_response.status_code != 200:
+            raise HTTPException(status_code=500, detail="Помилка YOLO сервісу")
+        
+        yolo_data = yolo_response.json()
+        plate_crops = yolo_data.get("plate_crops", [])
+        crops = yolo_data.get("crops")
+        if not plate_crops:
+            return plate_crops, []
+        if factor > 1:
+            if crops:
+                shm_transport.release(crops)
+                crops = None
+            bboxes, crops = await pools["codec"].run(
+                write_full_crops, contents, [crop_data["bbox"] for crop_data in plate_crops], factor
+            )
+            if bboxes is None:
+                raise HTTPException(status_code=400, detail="Не вдалося декодувати зображення")
+            plate_crops = [{"bbox": bbox} for bbox in bboxes]
+        
+        # 2. OCR читає crop зі спільної пам'яті одним батчем
+        async with limiters["ocr"]:
+            try:
+                ocr_response = await client.post(OCR_SHM_SERVICE_URL, json={"crops": crops})
+            except httpx.HTTPError as e:
+                return plate_crops, [(None, f"OCR недоступний: {e}")] * len(plate_crops)
+        
+        if ocr_response.status_code in (403, 404, 422):
+            # OCR не на цьому вузлі: передаємо вже готові crop через HTTP
+            disable_shm_transport(f"OCR HTTP {ocr_response.status_code}")
+            encoded = await pools["codec"].run(encode_shm_crops, crops)
+            for crop_data, jpeg in zip(plate_crops, encoded):
+                crop_data["jpeg"] = jpeg
+            return plate_crops, await recognize_crops(client, plate_crops)
+        return plate_crops, parse_batch_results(ocr_response, len(plate_crops))
+    
+    finally:
+        # Сегментами кадру та crop володіє gateway
+        shm_transport.release(frame)
+        if crops:
+            shm_transport.release(crops)
+
+async def detect_boxes_local(img):
+    if pipeline.needs_tiling(img.shape):
+        bboxes, _ = await pools["yolo"].run(pipeline.detect_tiled, img)
+    else:
+        bboxes, = await pools["yolo"].run(pipeline.yolo_predict, [img])
+    return bboxes
+
+
+async def detect_local(contents, source_id=None):
+    """
+    Увесь конвеєр у цьому процесі, без мережевих переходів і перекодувань.
+    Ті самі функції pipeline, що й у мікросервісах; для камери source_id —
+    лише в її зоні інтересу і без повторної детекції кадрів без руху.
+    """
+    img, factor = await pools["codec"].run(decode_for_detection, contents)
+    if img is None:
+        raise HTTPException(status_code=400, detail="Не вдалося декодувати зображення")
+    
+    bboxes = await camera_detect.detect_in_roi(
+        img, factor, source_id, detect_boxes_local, rois, gates.get("motion"), pools["codec"].run
+    )
+    if factor > 1 and bboxes:
+        # Детекція на зменшеному кадрі, crop з повного
+        bboxes, crops = await pools["codec"].run(decode_full_crops, contents, bboxes, factor)
+        if bboxes is None:
+            raise HTTPException(status_code=400, detail="Не вдалося декодувати зображення")
+    else:
+        crops = await pools["codec"].run(preprocess_crops, img, bboxes)
+    batch_fragments = await pools["ocr"].run(pipeline.ocr_predict, crops) if crops else []
+    
+    plate_crops = [{"bbox": bbox} for bbox in bboxes]
+    return plate_crops, [(fragments, None) for fragments in batch_fragments]
+
+
+async def run_detection(contents, source_id=None):
+    """
+    Повний конвеєр для байтів одного зображення через налаштований бекенд.
+    source_id (камера) передається детекції для пропуску нерухомих кадрів.
+    """
+    if GATEWAY_BACKEND == "local":
+        detected = await detect_local(contents, source_id)
+    else:
+        client = clients["http"]
+        detected = None
+        if use_shm_transport():
+            detected = await detect_via_shm(client, contents, source_id)
+        if detected is None:
+            detected = await detect_via_http(client, contents, source_id)
+    
+    # Результати йдуть у порядку bbox від YOLO
+    plate_crops, ocr_results = detected
+    return pipeline.assemble_cars(plate_crops, ocr_results)
+
+def preprocess_frame_crops(_, frames, bboxes_list):
+    return stream_ingest.preprocess_frame_crops(frames, bboxes_list)
+
+
+def encode_frames(_, frames):
+    return [cv2.imencode('.jpg', frame)[1].tobytes() for frame in frames]
+
+
+def frame_error(detail):
+    return {"cars": [], "errors": [{"bbox": None, "detail": detail}]}
+
+
+async def detect_frame_contents(contents):
+    # Помилка одного кадру стає подією цього кадру, а не обриває весь потік
+    try:
+        return await run_detection(contents)
+    except HTTPException as e:
+        return frame_error(e.detail)
+    except Exception as e:
+        return frame_error(f"Помилка обробки: {str(e)}")
+
+
+async def detect_frame_boxes(frames):
+    return await pools["yolo"].run(pipeline.yolo_predict, frames)
+
+
+async def recognize_local(crops):
+    return await pools["ocr"].run(pipeline.ocr_predict, crops)
+
+
+async def detect_frames(frames):
+    """
+    Детекція батчу декодованих кадрів відео.
+    У локальному бекенді — один виклик YOLO на батч і один батч OCR на всі crop,
+    інакше кожен кадр кодується в JPEG і проходить звичайний конвеєр мікросервісів.
+    """
+    if GATEWAY_BACKEND == "local":
+        try:
+            bboxes_list = await pools["yolo"].run(pipeline.yolo_predict, frames)
+            crops = await pools["codec"].run(preprocess_frame_crops, frames, bboxes_list)
+            batch_fragments = await pools["ocr"].run(pipeline.ocr_predict, crops) if crops else []
+        except Exception as e:
+            return [frame_error(f"Помилка обробки: {str(e)}") for _ in frames]
+        return stream_ingest.assemble_frames(bboxes_list, batch_fragments)
+    
+    encoded = await pools["codec"].run(encode_frames, frames)
+    return await asyncio.gather(*(detect_frame_contents(contents) for contents in encoded))
+
+
+def hash_contents(_, contents, source_id=None):
+    # Результат залежить від зони інтересу камери, тож камера входить у ключ
+    if source_id:
+        return content_key(source_id.encode("utf-8") + b"\0" + contents)
+    return content_key(contents)
+
+
+async def detect_cached(contents, source_id=None):
+    """
+    run_detection з кешем результатів за хешем вмісту завантаження
+    та об'єднанням однакових одночасних завантажень (один запуск конвеєра на всіх).
+    Кешуються лише результати без помилок OCR.
+    """
+    cache = caches.get("result")
+    flight = flights.get("detect")
+    if cache is None and flight is None:
+        return await run_detection(contents, source_id)
+    
+    key = await pools["codec"].run(hash_contents, contents, source_id)
+    if cache:
+        result = cache.get(key)
+        if result is None and cache.has_disk:
+            stored = await asyncio.to_thread(cache.get_disk, key)
+            if stored is not None:
+                result, expires_at = stored
+                cache.record_disk_hit()
+                cache.put(key, result, expires_at)
+        if result is not None:
+            return result
+        cache.record_miss()
+    
+    if flight:
+        return await flight.do(key, run_detection_and_cache, contents, key, source_id)
+    return await run_detection_and_cache(contents, key, source_id)
+
+
+async def run_detection_and_cache(contents, key, source_id=None):
+    result = await run_detection(contents, source_id)
+    cache = caches.get("result")
+    if cache and not result["errors"]:
+        cache.put(key, result)
+        if cache.has_disk:
+            await asyncio.to_thread(cache.put_disk, key, result)
+    return result
 
 # --- API ЕНДПОІНТ ---
 
 @app.post("/detect")
-async def detect_license_plate_endpoint(file: UploadFile = File(...)):
+async def detect_license_plate_endpoint(file: UploadFile = File(...), source_id: str = Form(None)):
     """
     Основний ендпоінт для обробки зображення.
-    Координує роботу YOLO та OCR сервісів.
+    Координує роботу YOLO та OCR (сервісів або вбудованих моделей).
+    source_id — ідентифікатор камери, з якої надійшов кадр (необов'язковий).
     """
     if not file.content_type or not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Файл має бути зображенням")
@@ -50,66 +744,134 @@ async def detect_license_plate_endpoint(file: UploadFile = File(...)):
     try:
         # Читання файлу
         contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if img is None:
-            raise HTTPException(status_code=400, detail="Не вдалося декодувати зображення")
-        
-        # Кодування зображення для відправки
-        _, img_encoded = cv2.imencode('.jpg', img)
-        img_bytes = img_encoded.tobytes()
-        
-        # 1. Відправка в YOLO сервіс
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            yolo_response = await client.post(
-                YOLO_SERVICE_URL,
-                files={"file": ("image.jpg", img_bytes, "image/jpeg")}
-            )
-            
-            if yolo_response.status_code != 200:
-                raise HTTPException(status_code=500, detail="Помилка YOLO сервісу")
-            
-            yolo_data = yolo_response.json()
-            plate_crops = yolo_data.get("plate_crops", [])
-        
-        detected_cars = []
-        
-        # 2. Відправка кожного crop в OCR сервіс
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            for crop_data in plate_crops:
-                # Декодування crop з base64
-                import base64
-                crop_bytes = base64.b64decode(crop_data["image"])
-                
-                # Відправка в OCR
-                ocr_response = await client.post(
-                    OCR_SERVICE_URL,
-                    files={"file": ("crop.jpg", crop_bytes, "image/jpeg")}
-                )
-                
-                if ocr_response.status_code == 200:
-                    ocr_data = ocr_response.json()
-                    fragments = ocr_data.get("fragments", [])
-                    
-                    if fragments:
-                        raw_text = " ".join(f["text"] for f in fragments)
-                        confidence = sum(f["confidence"] for f in fragments) / len(fragments)
-                        corrected = correct_plate_text(raw_text)
-                        
-                        if corrected and len(corrected) >= 5:
-                            detected_cars.append({
-                                "plate": corrected,
-                                "raw_text": raw_text,
-                                "confidence": round(confidence * 100, 1)
-                            })
-        
-        return {"cars": detected_cars}
+        return await detect_cached(contents, source_id)
     
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Помилка обробки: {str(e)}")
 
+
+@app.post("/detect_stream")
+async def detect_stream_endpoint(
+    source: str = Body(...),
+    sample_fps: float = Body(stream_ingest.STREAM_SAMPLE_FPS),
+    max_frames: int = Body(0),
+    track: bool = Body(None)
+):
+    """
+    Номери з відеофайлу або RTSP/MJPEG потоку.
+    Відповідь — NDJSON: подія "plates" на кожен кадр з номерами, в кінці "end".
+    З трекінгом (track, за замовчуванням STREAM_TRACKING у локальному бекенді) —
+    подія "track" з одним номером на авто та OCR лише найкращих crop треку.
+    Помилка обробки кадру не обриває потік: вона приходить у "errors" кадру
+    або, з трекінгом, подією "error".
+    """
+    error = stream_ingest.check_source(source)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    if track is None:
+        track = STREAM_TRACKING and GATEWAY_BACKEND == "local"
+    if track and GATEWAY_BACKEND != "local":
+        raise HTTPException(status_code=400, detail="Трекінг потребує GATEWAY_BACKEND=local")
+    
+    reader = stream_ingest.FrameReader(stream_ingest.resolve_source(source), sample_fps, max_frames=max_frames)
+    try:
+        await asyncio.to_thread(reader.start)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if track:
+        events = stream_ingest.stream_tracked_events(reader, detect_frame_boxes, recognize_local, pools["codec"].run)
+    else:
+        events = stream_ingest.stream_events(reader, detect_frames)
+    
+    async def ndjson():
+        async for event in events:
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+@app.websocket("/ws/detect")
+async def detect_websocket(websocket: WebSocket, source_id: str = None):
+    """
+    Безперервна передача кадрів одним з'єднанням (кіоски, шлагбауми).
+    Кожне бінарне повідомлення — зображення; кадри нумеруються з 0 у порядку надходження.
+    До WS_MAX_IN_FLIGHT кадрів обробляються паралельно, результати надсилаються
+    текстом JSON по готовності: {"frame_id", "cars", "errors"} або {"frame_id", "error"}.
+    source_id у query — камера для зони інтересу та пропуску кадрів без руху.
+    """
+    await websocket.accept()
+    in_flight = asyncio.Semaphore(WS_MAX_IN_FLIGHT)
+    send_lock = asyncio.Lock()
+    pending = set()
+    
+    async def send(message):
+        try:
+            async with send_lock:
+                await websocket.send_text(json.dumps(message, ensure_ascii=False))
+        except (WebSocketDisconnect, RuntimeError):
+            # Клієнт уже відключився
+            pass
+    
+    async def process(frame_id, contents, started):
+        try:
+            try:
+                message = {"frame_id": frame_id, **await detect_cached(contents, source_id)}
+            except HTTPException as e:
+                message = {"frame_id": frame_id, "error": e.detail}
+            except Exception as e:
+                message = {"frame_id": frame_id, "error": f"Помилка обробки: {str(e)}"}
+            await send(message)
+            ws_frame_ms.add((time.perf_counter() - started) * 1000.0)
+        finally:
+            in_flight.release()
+    
+    ws_state["connections"] += 1
+    frame_id = 0
+    try:
+        while True:
+            await in_flight.acquire()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            contents = message.get("bytes")
+            if not contents:
+                in_flight.release()
+                await send({"frame_id": None, "error": "Очікується бінарне повідомлення з зображенням"})
+                continue
+            
+            task = asyncio.create_task(process(frame_id, contents, time.perf_counter()))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            frame_id += 1
+    finally:
+        ws_state["connections"] -= 1
+        for task in pending:
+            task.cancel()
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Розмір відповіді YOLO та CPU gateway на її розбір для кожного формату crop,
+    статистика кешу результатів, об'єднання однакових запитів
+    пропуску нерухомих кадрів (локальний бекенд) та WebSocket з'єднань.
+    """
+    return {
+        "result_cache": caches["result"].metrics() if "result" in caches else None,
+        "singleflight": flights["detect"].metrics() if "detect" in flights else None,
+        "motion_gate": gates["motion"].metrics() if "motion" in gates else None,
+        "websocket": {**ws_state, "frame_ms": ws_frame_ms.summary()},
+        "yolo_payload_bytes": {name: stats.summary() for name, stats in yolo_payload_bytes.items()},
+        "yolo_parse_cpu_ms": {name: stats.summary() for name, stats in yolo_parse_cpu_ms.items()}
+    }
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
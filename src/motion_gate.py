@@ -0,0 +1,124 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import cv2
+
+from service_metrics import RollingStats
+
+# Пропуск детекції на нерухомих кадрах стаціонарних камер.
+# Кадр зменшується до MOTION_GATE_WIDTH і порівнюється з кадром, на якому камера
+# детектувалась востаннє: якщо змінилась менша частка пікселів, ніж MOTION_AREA_RATIO,
+# bbox тієї детекції ще дійсні і повертаються замість запуску YOLO.
+
+MOTION_GATE_ENABLED = os.getenv("MOTION_GATE_ENABLED", "1") == "1"
+# Ширина зменшеного кадру для порівняння (висота — за пропорціями)
+MOTION_GATE_WIDTH = int(os.getenv("MOTION_GATE_WIDTH", "160"))
+# Чутливість: різниця яскравості пікселя і частка змінених пікселів, що вважаються рухом
+MOTION_PIXEL_THRESHOLD = int(os.getenv("MOTION_PIXEL_THRESHOLD", "25"))
+MOTION_AREA_RATIO = float(os.getenv("MOTION_AREA_RATIO", "0.002"))
+# Після стількох пропусків поспіль детекція запускається примусово (0 = без обмеження)
+MOTION_MAX_SKIPS = int(os.getenv("MOTION_MAX_SKIPS", "50"))
+# Скільки камер тримати в пам'яті (найдавніші витісняються)
+MOTION_MAX_CAMERAS = int(os.getenv("MOTION_MAX_CAMERAS", "1024"))
+
+
+class CameraState:
+    def __init__(self, shape):
+        self.shape = shape
+        # Зменшений кадр останньої детекції, його номер і bbox
+        self.reference = None
+        self.reference_seq = -1
+        self.bboxes = None
+        self.skips = 0
+
+
+class MotionGate:
+    """
+    Стан руху для кожної камери (ключ — source_id).
+    Потокобезпечний: check викликається з потоків пулу кодування.
+    """
+
+    def __init__(self):
+        self._cameras = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"frames": 0, "skipped": 0}
+        # Наскрізна нумерація кадрів, що пішли на детекцію
+        self._seq = 0
+        self.gate_ms = RollingStats()
+
+    def check(self, key, img):
+        """
+        Повертає (bboxes, None), якщо кадр з останньої детекції камери не змінився,
+        інакше (None, token) — кадр треба детектувати і передати token разом
+        з результатом у remember. Кадри однієї камери можуть детектуватись паралельно,
+        тож token прив'язує bbox саме до цього кадру.
+        """
+        started = time.perf_counter()
+        small = self._downsample(img)
+        with self._lock:
+            state = self._cameras.get(key)
+            if state is None or state.shape != img.shape[:2]:
+                state = CameraState(img.shape[:2])
+                self._cameras[key] = state
+                while len(self._cameras) > MOTION_MAX_CAMERAS:
+                    self._cameras.popitem(last=False)
+            else:
+                self._cameras.move_to_end(key)
+
+            skip = (
+                state.reference is not None
+                and (MOTION_MAX_SKIPS <= 0 or state.skips < MOTION_MAX_SKIPS)
+                and not self._moved(small, state.reference)
+            )
+            self._stats["frames"] += 1
+            if skip:
+                state.skips += 1
+                self._stats["skipped"] += 1
+                bboxes, token = [list(bbox) for bbox in state.bboxes], None
+            else:
+                self._seq += 1
+                bboxes, token = None, (self._seq, state.shape, small)
+        self.gate_ms.add((time.perf_counter() - started) * 1000.0)
+        return bboxes, token
+
+    def remember(self, key, token, bboxes):
+        """
+        Зберігає bbox кадру token як нову точку відліку камери,
+        якщо тим часом не збережено результат новішого кадру.
+        """
+        seq, shape, small = token
+        with self._lock:
+            state = self._cameras.get(key)
+            if state is None or state.shape != shape or seq <= state.reference_seq:
+                return
+            state.reference, state.reference_seq = small, seq
+            state.bboxes = [list(bbox) for bbox in bboxes]
+            state.skips = 0
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            cameras = len(self._cameras)
+        return {
+            **stats,
+            "skip_ratio": round(stats["skipped"] / stats["frames"], 3) if stats["frames"] else 0.0,
+            "cameras": cameras,
+            "gate_ms": self.gate_ms.summary(),
+        }
+
+    def _downsample(self, img):
+        h, w = img.shape[:2]
+        width = min(w, MOTION_GATE_WIDTH)
+        height = max(1, round(h * width / w))
+        small = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        # Згладжування прибирає шум сенсора і стиснення
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def _moved(self, small, reference):
+        diff = cv2.absdiff(small, reference)
+        _, changed = cv2.threshold(diff, MOTION_PIXEL_THRESHOLD, 255, cv2.THRESH_BINARY)
+        return cv2.countNonZero(changed) > MOTION_AREA_RATIO * changed.size
@@ -1,28 +1,222 @@
+import os
+import time
 import uvicorn
 import cv2
 import numpy as np
+from typing import List
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from paddleocr import PaddleOCR
+from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Request
+
+from inference_pool import InferencePool
+import prefork
+import shm_transport
+import crop_frame
+from pipeline import OCR_BACKEND, OCR_FAST_MODEL_DIR, load_ocr, load_ocr_fast, ocr_predict, is_confident_plate
+from service_metrics import RollingStats
+from crop_cache import CropCache, dhash
+from result_cache import content_key
+from singleflight import SingleFlight
+
+# Кількість потоків інференсу (кожен з власною копією моделі) та потоків для кодування
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+CODEC_WORKERS = int(os.getenv("CODEC_WORKERS", "2"))
+
+# Режим кількох процесів: модель завантажується в батьківському процесі один раз,
+# воркери отримують її через fork (copy-on-write) і приймають запити з одного сокета
+WORKERS = int(os.getenv("WORKERS", "1"))
+PREFORK_PRELOAD = os.getenv("PREFORK_PRELOAD", "1") == "1"
+CPU_PINNING = os.getenv("CPU_PINNING", "1") == "1"
+# Потоків на воркер для intra-op паралелізму (0 = ядра воркера)
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "0"))
+
+# Кеш OCR за перцептивним хешем crop (CROP_CACHE_SIZE=0 вимикає)
+CROP_CACHE_SIZE = int(os.getenv("CROP_CACHE_SIZE", "4096"))
+CROP_CACHE_MAX_DISTANCE = int(os.getenv("CROP_CACHE_MAX_DISTANCE", "6"))
+CROP_CACHE_MIN_CONFIDENCE = float(os.getenv("CROP_CACHE_MIN_CONFIDENCE", "0.9"))
+
+# Каскад (вмикається OCR_FAST_MODEL_DIR): результат швидкого розпізнавача приймається,
+# якщо номер відповідає формату AA1234BB і всі фрагменти не менш упевнені за поріг
+OCR_CASCADE_MIN_CONFIDENCE = float(os.getenv("OCR_CASCADE_MIN_CONFIDENCE", "0.9"))
+
+# Об'єднання однакових crop, що розпізнаються одночасно
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "1") == "1"
 
 # --- ГЛОБАЛЬНІ ЗМІННІ ---
-models = {}
+pools = {}
+preloaded = {}
+caches = {}
+flights = {}
+# Каскад: скільки crop прийнято з кожного рівня та затримка батчу рівня (мс)
+cascade_counts = {"fast": 0, "server": 0}
+cascade_latency_ms = {"fast": RollingStats(), "server": RollingStats()}
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("Завантаження OCR моделі...")
+    print(f"Завантаження OCR моделі (бекенд {OCR_BACKEND})...")
+    pools["ocr"] = InferencePool(
+        load_ocr,
+        workers=INFERENCE_WORKERS,
+        name="ocr",
+        preloaded=preloaded.get("ocr")
+    )
+    pools["codec"] = InferencePool(workers=CODEC_WORKERS, name="codec")
     try:
-        models["ocr"] = PaddleOCR(text_recognition_model_dir='train_models/OCR')
-        print("OCR модель успішно завантажено.")
+        pools["ocr"].start()
+        print(f"OCR модель успішно завантажено ({INFERENCE_WORKERS} потоків).")
     except Exception as e:
         print(f"Помилка завантаження OCR: {e}")
     
+    if OCR_FAST_MODEL_DIR:
+        print(f"Завантаження швидкої OCR моделі з {OCR_FAST_MODEL_DIR}...")
+        pools["ocr_fast"] = InferencePool(
+            load_ocr_fast,
+            workers=INFERENCE_WORKERS,
+            name="ocr_fast",
+            preloaded=preloaded.get("ocr_fast")
+        )
+        try:
+            pools["ocr_fast"].start()
+        except Exception as e:
+            print(f"Помилка завантаження швидкої OCR моделі, каскад вимкнено: {e}")
+            pools.pop("ocr_fast").shutdown()
+    
+    if CROP_CACHE_SIZE > 0:
+        caches["crop"] = CropCache(
+            max_entries=CROP_CACHE_SIZE,
+            max_distance=CROP_CACHE_MAX_DISTANCE,
+            min_confidence=CROP_CACHE_MIN_CONFIDENCE
+        )
+    
+    if SINGLEFLIGHT_ENABLED:
+        flights["ocr"] = SingleFlight()
+    
     yield
     
-    models.clear()
+    caches.clear()
+    flights.clear()
+    
+    for pool in pools.values():
+        pool.shutdown()
+    pools.clear()
 
 app = FastAPI(lifespan=lifespan)
 
+
+def decode_images(_, contents_list):
+    return [
+        cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
+        for contents in contents_list
+    ]
+
+
+def decode_frame_crops(_, entries):
+    """
+    Декодує сірі crop з кадру crop_frame у BGR (None для пошкоджених).
+    """
+    images = []
+    for entry in entries:
+        try:
+            gray = crop_frame.decode_crop(entry)
+        except ValueError:
+            gray = None
+        images.append(None if gray is None else cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR))
+    return images
+
+
+def read_shm_crops(_, handle):
+    return shm_transport.read_arrays(handle)
+
+
+def hash_crops(_, images):
+    """
+    Для кожного crop: перцептивний хеш, точний хеш пікселів (для singleflight)
+    і результат з кешу crop або None. Пошук найближчого хешу — тут, поза event loop.
+    """
+    cache = caches.get("crop")
+    perceptual = [dhash(img) for img in images]
+    exact = [content_key(str(img.shape).encode() + img.tobytes()) for img in images]
+    results = [cache.lookup(h) for h in perceptual] if cache else [None] * len(images)
+    return perceptual, exact, results
+
+
+def store_crops(_, cache, hashes, batch_fragments):
+    for key, fragments in zip(hashes, batch_fragments):
+        cache.store(key, fragments)
+
+
+async def timed_predict(tier, images):
+    started = time.perf_counter()
+    results = await pools["ocr" if tier == "server" else "ocr_fast"].run(ocr_predict, images)
+    cascade_latency_ms[tier].add((time.perf_counter() - started) * 1000.0)
+    return results
+
+
+async def recognize_cascade(images):
+    """
+    Розпізнавання без кешу. З каскадом спершу швидкий розпізнавач, а на серверну модель
+    ідуть лише crop, чий результат не схожий на номер або недостатньо впевнений.
+    """
+    if "ocr_fast" not in pools:
+        return await pools["ocr"].run(ocr_predict, images)
+    
+    results = await timed_predict("fast", images)
+    escalate = [i for i, fragments in enumerate(results)
+                if not is_confident_plate(fragments, OCR_CASCADE_MIN_CONFIDENCE)]
+    cascade_counts["fast"] += len(images) - len(escalate)
+    cascade_counts["server"] += len(escalate)
+    if escalate:
+        server_results = await timed_predict("server", [images[i] for i in escalate])
+        for i, fragments in zip(escalate, server_results):
+            results[i] = fragments
+    return results
+
+
+def cascade_metrics():
+    total = cascade_counts["fast"] + cascade_counts["server"]
+    return {
+        "min_confidence": OCR_CASCADE_MIN_CONFIDENCE,
+        "accepted_fast": cascade_counts["fast"],
+        "escalated": cascade_counts["server"],
+        # Частка crop, для яких серверна модель не запускалась
+        "fast_hit_ratio": round(cascade_counts["fast"] / total, 4) if total else 0.0,
+        "fast_batch_ms": cascade_latency_ms["fast"].summary(),
+        "server_batch_ms": cascade_latency_ms["server"].summary(),
+    }
+
+
+async def recognize_images(images):
+    """
+    OCR для списку crop з кешем за перцептивним хешем та об'єднанням однакових crop,
+    які вже розпізнаються іншим запитом: у розпізнавач іде лише батч решти crop.
+    """
+    cache = caches.get("crop")
+    flight = flights.get("ocr")
+    if cache is None and flight is None:
+        return await recognize_cascade(images)
+    
+    hashes, keys, results = await pools["codec"].run(hash_crops, images)
+    missing = [i for i, fragments in enumerate(results) if fragments is None]
+    if not missing:
+        return results
+    
+    positions = {keys[i]: i for i in missing}
+    
+    async def run_batch(batch_keys):
+        fresh = await recognize_cascade([images[positions[key]] for key in batch_keys])
+        if cache:
+            await pools["codec"].run(store_crops, cache, [hashes[positions[key]] for key in batch_keys], fresh)
+        return fresh
+    
+    if flight:
+        fresh = await flight.do_batch([keys[i] for i in missing], run_batch)
+    else:
+        fresh = await run_batch([keys[i] for i in missing])
+    for i, fragments in zip(missing, fresh):
+        results[i] = fragments
+    return results
+
+
 @app.post("/recognize_text")
 async def recognize_text(file: UploadFile = File(...)):
     """
@@ -34,28 +228,147 @@ async def recognize_text(file: UploadFile = File(...)):
     try:
         # Читання файлу
         contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        img, = await pools["codec"].run(decode_images, [contents])
         
         if img is None:
             raise HTTPException(status_code=400, detail="Не вдалося декодувати зображення")
         
         # OCR розпізнавання
-        ocr_out = models["ocr"].predict(img)
-        
-        fragments = []
-        if ocr_out and isinstance(ocr_out, list):
-            rec = ocr_out[0]
-            texts = rec.get('rec_texts', [])
-            scores = rec.get('rec_scores', [])
-            for txt, score in zip(texts, scores):
-                if txt and score > 0.3:
-                    fragments.append({"text": txt, "confidence": score})
+        fragments, = await recognize_images([img])
         
         return {"fragments": fragments}
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Помилка OCR: {str(e)}")
 
+
+@app.post("/recognize_text_batch")
+async def recognize_text_batch(files: List[UploadFile] = File(...)):
+    """
+    Розпізнавання тексту для кількох crop за один запит.
+    Усі зображення подаються в розпізнавач одним батчем,
+    результати повертаються в порядку файлів запиту.
+    """
+    try:
+        results = [None] * len(files)
+        contents_list = []
+        positions = []
+        for i, file in enumerate(files):
+            if not file.content_type or not file.content_type.startswith("image/"):
+                results[i] = {"error": "Файл має бути зображенням"}
+                continue
+            contents_list.append(await file.read())
+            positions.append(i)
+        
+        decoded = await pools["codec"].run(decode_images, contents_list)
+        images = []
+        image_positions = []
+        for i, img in zip(positions, decoded):
+            if img is None:
+                results[i] = {"error": "Не вдалося декодувати зображення"}
+                continue
+            images.append(img)
+            image_positions.append(i)
+        
+        # OCR розпізнавання одним батчем
+        if images:
+            batch_fragments = await recognize_images(images)
+            for i, fragments in zip(image_positions, batch_fragments):
+                results[i] = {"fragments": fragments}
+        
+        return {"results": results}
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Помилка OCR: {str(e)}")
+
+
+
+@app.post("/recognize_text_frame")
+async def recognize_text_frame(request: Request):
+    """
+    Розпізнавання crop, переданих одним бінарним кадром crop_frame
+    (тіло запиту у форматі application/x-plate-crops, як повертає YOLO сервіс).
+    Відповідь у тому ж форматі, що й /recognize_text_batch.
+    """
+    if request.headers.get("content-type", "").split(";")[0].strip() != crop_frame.CONTENT_TYPE:
+        raise HTTPException(status_code=415, detail=f"Очікується {crop_frame.CONTENT_TYPE}")
+    
+    try:
+        entries = crop_frame.unpack(await request.body())
+    except (ValueError, KeyError) as e:
+        raise HTTPException(status_code=400, detail=f"Некоректний кадр crop: {e}")
+    
+    try:
+        decoded = await pools["codec"].run(decode_frame_crops, entries)
+        results = [{"error": "Не вдалося декодувати зображення"}] * len(decoded)
+        positions = [i for i, img in enumerate(decoded) if img is not None]
+        
+        # OCR розпізнавання одним батчем
+        if positions:
+            batch_fragments = await recognize_images([decoded[i] for i in positions])
+            for i, fragments in zip(positions, batch_fragments):
+                results[i] = {"fragments": fragments}
+        
+        return {"results": results}
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Помилка OCR: {str(e)}")
+
+
+@app.post("/recognize_text_shm")
+async def recognize_text_shm(request: Request, crops: dict = Body(..., embed=True)):
+    """
+    Розпізнавання crop, які YOLO сервіс поклав у спільну пам'ять.
+    Відповідь у тому ж форматі, що й /recognize_text_batch.
+    Лише для клієнтів на цьому вузлі (SHM_LOOPBACK_ONLY) і сегментів сервісів.
+    """
+    if not shm_transport.is_allowed_client(request.client.host if request.client else None):
+        raise HTTPException(status_code=403, detail="Спільна пам'ять доступна лише локальним клієнтам")
+    try:
+        images = await pools["codec"].run(read_shm_crops, crops)
+    except FileNotFoundError:
+        raise HTTPException(status_code=422, detail="Сегмент спільної пам'яті не знайдено")
+    except (ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Некоректний handle сегмента: {e}")
+    
+    try:
+        batch_fragments = await recognize_images(images) if images else []
+        return {"results": [{"fragments": fragments} for fragments in batch_fragments]}
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Помилка OCR: {str(e)}")
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Статистика кешу crop (частка crop, для яких OCR не запускався),
+    об'єднання однакових одночасних crop та рівнів каскаду.
+    """
+    return {
+        "crop_cache": caches["crop"].metrics() if "crop" in caches else None,
+        "singleflight": flights["ocr"].metrics() if "ocr" in flights else None,
+        "cascade": cascade_metrics() if "ocr_fast" in pools else None
+    }
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+def preload_model():
+    print("Попереднє завантаження моделі для воркерів...")
+    preloaded["ocr"] = load_ocr()
+    if OCR_FAST_MODEL_DIR:
+        preloaded["ocr_fast"] = load_ocr_fast()
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8002)
+    if WORKERS > 1:
+        prefork.serve(
+            app, "0.0.0.0", 8002, WORKERS,
+            preload=preload_model if PREFORK_PRELOAD else None,
+            cpu_pinning=CPU_PINNING,
+            threads=WORKER_THREADS or None
+        )
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8002)
@@ -0,0 +1,146 @@
+import os
+import ast
+import shutil
+import tempfile
+
+import cv2
+import numpy as np
+
+# Потоки ONNX Runtime: intra-op — паралелізм всередині оператора, inter-op — між операторами
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", os.getenv("OMP_NUM_THREADS", "0")))
+ONNX_INTER_OP_THREADS = int(os.getenv("ONNX_INTER_OP_THREADS", "1"))
+
+# Розмір входу, якщо в метаданих моделі його немає
+ONNX_IMGSZ = int(os.getenv("ONNX_IMGSZ", "640"))
+
+# Колір заповнення letterbox, як в ultralytics
+LETTERBOX_COLOR = (114, 114, 114)
+
+
+def export_onnx(pt_path, onnx_path, imgsz=ONNX_IMGSZ):
+    """
+    Одноразовий експорт ваг ultralytics (.pt) в ONNX з динамічним батчем.
+    Експорт іде в тимчасовий каталог, а готовий файл атомарно переноситься в onnx_path:
+    паралельні процеси не бачать недописаний ONNX і не перезаписують файли один одного.
+    Повертає шлях до ONNX файлу.
+    """
+    from ultralytics import YOLO
+    target_dir = os.path.dirname(os.path.abspath(onnx_path))
+    with tempfile.TemporaryDirectory(dir=target_dir, prefix=".onnx_export_") as tmp_dir:
+        tmp_pt = os.path.join(tmp_dir, os.path.basename(pt_path))
+        shutil.copyfile(pt_path, tmp_pt)
+        exported = YOLO(tmp_pt).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+        os.replace(exported, onnx_path)
+    return onnx_path
+
+
+def create_session(path, intra_op_threads=ONNX_INTRA_OP_THREADS, inter_op_threads=ONNX_INTER_OP_THREADS):
+    """
+    Сесія ONNX Runtime на CPU з усіма оптимізаціями графа.
+    """
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+
+def letterbox(img, size):
+    """
+    Масштабує зображення зі збереженням пропорцій і доповнює до size x size по центру,
+    як LetterBox ultralytics. Повертає (зображення, масштаб, (зсув x, зсув y)).
+    """
+    h, w = img.shape[:2]
+    scale = min(size / h, size / w)
+    new_w, new_h = int(round(w * scale)), int(round(h * scale))
+    if (new_w, new_h) != (w, h):
+        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    dw, dh = (size - new_w) / 2, (size - new_h) / 2
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=LETTERBOX_COLOR)
+    return img, scale, (left, top)
+
+
+class OnnxDetector:
+    """
+    Детектор номерів на ONNX Runtime (CPU) для моделі YOLO, експортованої ultralytics.
+
+    detect() повертає для кожного зображення (bboxes, scores) у координатах оригіналу,
+    bbox у форматі [x1, y1, x2, y2] як у yolo_predict.
+
+    Пул потоків ONNX Runtime не переживає fork, тож воркер prefork, що отримав
+    детектор від батьківського процесу, при першому виклику створює власну сесію.
+    """
+
+    def __init__(self, path, intra_op_threads=ONNX_INTRA_OP_THREADS, inter_op_threads=ONNX_INTER_OP_THREADS):
+        self._path = path
+        self._intra_op_threads = intra_op_threads
+        self._inter_op_threads = inter_op_threads
+        self._session = self._create_session()
+        self._pid = os.getpid()
+
+        model_input = self._session.get_inputs()[0]
+        self._input_name = model_input.name
+        # Модель, експортована без dynamic=True, приймає лише батч 1
+        self._max_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+
+        metadata = self._session.get_modelmeta().custom_metadata_map
+        imgsz = ast.literal_eval(metadata["imgsz"]) if "imgsz" in metadata else [ONNX_IMGSZ]
+        self._size = imgsz[0] if isinstance(imgsz, (list, tuple)) else int(imgsz)
+
+    def _create_session(self):
+        return create_session(self._path, self._intra_op_threads, self._inter_op_threads)
+
+    def detect(self, images, conf=0.25, iou=0.45):
+        if self._pid != os.getpid():
+            self._session = self._create_session()
+            self._pid = os.getpid()
+
+        inputs = []
+        transforms = []
+        for img in images:
+            padded, scale, pad = letterbox(img, self._size)
+            inputs.append(cv2.cvtColor(padded, cv2.COLOR_BGR2RGB).transpose(2, 0, 1))
+            transforms.append((scale, pad, img.shape[:2]))
+        if not inputs:
+            return []
+        batch = np.ascontiguousarray(np.stack(inputs), dtype=np.float32) / 255.0
+
+        step = self._max_batch or len(images)
+        outputs = []
+        for start in range(0, len(images), step):
+            outputs.extend(self._session.run(None, {self._input_name: batch[start:start + step]})[0])
+
+        return [
+            self._postprocess(output, conf, iou, *transform)
+            for output, transform in zip(outputs, transforms)
+        ]
+
+    def _postprocess(self, output, conf, iou, scale, pad, shape):
+        # Вихід YOLOv8: (4 + класи, кандидати), рамки як cx, cy, w, h у просторі letterbox
+        predictions = output.T
+        class_scores = predictions[:, 4:]
+        class_ids = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(class_ids)), class_ids]
+        keep = scores > conf
+        predictions, scores, class_ids = predictions[keep], scores[keep], class_ids[keep]
+        if not len(scores):
+            return [], []
+
+        cx, cy, w, h = predictions[:, 0], predictions[:, 1], predictions[:, 2], predictions[:, 3]
+        boxes = np.stack([cx - w / 2, cy - h / 2, w, h], axis=1)
+        # NMS окремо для кожного класу, як в ultralytics за замовчуванням
+        indices = cv2.dnn.NMSBoxesBatched(boxes.tolist(), scores.tolist(), class_ids.tolist(), conf, iou)
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        indices = indices[np.argsort(-scores[indices], kind="stable")]
+
+        height, width = shape
+        xyxy = boxes[indices].copy()
+        xyxy[:, 2:] += xyxy[:, :2]
+        xyxy[:, [0, 2]] = ((xyxy[:, [0, 2]] - pad[0]) / scale).clip(0, width)
+        xyxy[:, [1, 3]] = ((xyxy[:, [1, 3]] - pad[1]) / scale).clip(0, height)
+        return [list(map(int, box)) for box in xyxy], [float(s) for s in scores[indices]]
@@ -0,0 +1,51 @@
+import os
+
+from onnx_detector import create_session, ONNX_INTRA_OP_THREADS, ONNX_INTER_OP_THREADS
+from crop_preprocess import load_rec_config, to_batch
+
+
+class OnnxRecognizer:
+    """
+    Розпізнавач PP-OCRv5 (rec), сконвертований в ONNX, на ONNX Runtime (CPU).
+
+    predict() повертає для кожного crop {"rec_text", "rec_score"} — як TextRecognition
+    PaddleOCR, тож pipeline.ocr_predict працює з ним без змін.
+    Як і OnnxDetector, після fork створює власну сесію.
+    """
+
+    def __init__(self, path, model_dir, intra_op_threads=ONNX_INTRA_OP_THREADS, inter_op_threads=ONNX_INTER_OP_THREADS):
+        self._path = path
+        self._intra_op_threads = intra_op_threads
+        self._inter_op_threads = inter_op_threads
+        self._session = create_session(path, intra_op_threads, inter_op_threads)
+        self._pid = os.getpid()
+        self._input_name = self._session.get_inputs()[0].name
+
+        self._image_shape, characters = load_rec_config(model_dir)
+        # Індекс 0 — blank CTC; пробіл додається в кінець словника, якщо модель його має
+        self._characters = ["blank"] + characters
+        num_classes = self._session.get_outputs()[0].shape[-1]
+        if isinstance(num_classes, int) and num_classes == len(self._characters) + 1:
+            self._characters.append(" ")
+
+    def predict(self, images, batch_size=8):
+        if self._pid != os.getpid():
+            self._session = create_session(self._path, self._intra_op_threads, self._inter_op_threads)
+            self._pid = os.getpid()
+
+        results = []
+        for start in range(0, len(images), batch_size):
+            inputs = to_batch(images[start:start + batch_size], self._image_shape)
+            probs = self._session.run(None, {self._input_name: inputs})[0]
+            results.extend(self._decode(p) for p in probs)
+        return results
+
+    def _decode(self, probs):
+        # Жадібне CTC декодування: прибираємо повтори й blank
+        indices = probs.argmax(axis=1)
+        scores = probs.max(axis=1)
+        keep = indices != 0
+        keep[1:] &= indices[1:] != indices[:-1]
+        text = "".join(self._characters[i] for i in indices[keep] if i < len(self._characters))
+        score = float(scores[keep].mean()) if keep.any() else 0.0
+        return {"rec_text": text, "rec_score": score}
@@ -0,0 +1,378 @@
+import os
+import re
+import threading
+import cv2
+import numpy as np
+
+import image_header
+import crop_preprocess
+
+# Спільна логіка конвеєра detect → preprocess → recognize → correct_plate_text.
+# Її використовують і мікросервіси (yolo_server, ocr_server, main_server),
+# і вбудований режим gateway, тож поведінка не може розійтися.
+
+YOLO_MODEL_PATH = os.getenv("YOLO_MODEL_PATH", 'train_models/YOLO/my_YOLO_detection_car_plates.pt')
+
+# ultralytics: PyTorch через ultralytics.YOLO
+# onnx: ONNX Runtime на CPU; ваги експортуються в YOLO_ONNX_PATH при першому запуску
+# (для INT8 моделі вкажіть у YOLO_ONNX_PATH результат quantize_models.py)
+DETECTOR_BACKEND = os.getenv("DETECTOR_BACKEND", "ultralytics")
+YOLO_ONNX_PATH = os.getenv("YOLO_ONNX_PATH", os.path.splitext(YOLO_MODEL_PATH)[0] + '.onnx')
+
+# Пороги детекції
+YOLO_CONF = 0.3
+YOLO_IOU = 0.5
+
+# Великі JPEG для детекції декодуються зі зменшенням (масштабування DCT),
+# але так, щоб довша сторона лишалась не меншою за DETECT_MIN_SIDE: YOLO однаково
+# зменшує кадр до 640. Crop вирізаються з повного декодування в сірому.
+DETECT_MIN_SIDE = int(os.getenv("DETECT_MIN_SIDE", "640"))
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# Детекція плитками для оглядових кадрів, де номер займає кілька десятків пікселів:
+# кадр із довшою стороною від TILING_MIN_SIDE (0 = вимкнено) ділиться на плитки
+# TILE_SIZE з перекриттям TILE_OVERLAP, усі плитки йдуть у YOLO одним батчем
+TILING_MIN_SIDE = int(os.getenv("TILING_MIN_SIDE", "0"))
+TILE_SIZE = int(os.getenv("TILE_SIZE", "1280"))
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.2"))
+# Додати до батчу весь кадр, щоб не загубити великі номери, розрізані межею плиток
+TILE_FULL_FRAME = os.getenv("TILE_FULL_FRAME", "1") == "1"
+# Поріг злиття детекцій з різних плиток: перетин / площа меншого bbox
+TILE_MERGE_THRESHOLD = float(os.getenv("TILE_MERGE_THRESHOLD", "0.5"))
+
+OCR_MODEL_DIR = os.getenv("OCR_MODEL_DIR", 'train_models/OCR')
+# Назва моделі розпізнавача з inference.yml
+OCR_MODEL_NAME = os.getenv("OCR_MODEL_NAME", "PP-OCRv5_server_rec")
+
+# rec: лише модель розпізнавання над готовими crop номерів
+# onnx: та сама модель розпізнавання, сконвертована в ONNX (OCR_ONNX_PATH), на ONNX Runtime
+# pipeline: повний конвеєр PaddleOCR (детекція рядків тексту і т.д.), для порівняння
+OCR_BACKEND = os.getenv("OCR_BACKEND", "rec")
+OCR_ONNX_PATH = os.getenv("OCR_ONNX_PATH", os.path.join(OCR_MODEL_DIR, 'inference.onnx'))
+
+# Геометрія входу розпізнавача: crop готуються одразу під неї
+REC_IMAGE_SHAPE = crop_preprocess.rec_image_shape(OCR_MODEL_DIR)
+
+# Каскад: швидкий (mobile) розпізнавач першим, серверний — лише для сумнівних crop.
+# Порожній OCR_FAST_MODEL_DIR вимикає каскад. Бекенд той самий, що й OCR_BACKEND.
+OCR_FAST_MODEL_DIR = os.getenv("OCR_FAST_MODEL_DIR", "")
+OCR_FAST_MODEL_NAME = os.getenv("OCR_FAST_MODEL_NAME", "PP-OCRv5_mobile_rec")
+OCR_FAST_ONNX_PATH = os.getenv("OCR_FAST_ONNX_PATH", os.path.join(OCR_FAST_MODEL_DIR, 'inference.onnx'))
+
+# Розмір батчу розпізнавача (inference.yml допускає динамічний батч до 8)
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "8"))
+
+
+# --- ЗАВАНТАЖЕННЯ МОДЕЛЕЙ ---
+# Імпорти всередині функцій: gateway у режимі HTTP не тягне ultralytics і paddle
+
+# Потоки пулу інференсу завантажують моделі паралельно, а експорт має відбутись один раз
+_export_lock = threading.Lock()
+
+
+def prepare_yolo():
+    """
+    Експортує YOLO в ONNX, якщо файлу ще немає. Сервіси викликають це до старту
+    пулу і до fork воркерів, щоб експорт не запускався в кожному з них.
+    """
+    if DETECTOR_BACKEND != "onnx":
+        return
+    with _export_lock:
+        if not os.path.exists(YOLO_ONNX_PATH):
+            from onnx_detector import export_onnx
+            print(f"Експорт {YOLO_MODEL_PATH} в ONNX...")
+            export_onnx(YOLO_MODEL_PATH, YOLO_ONNX_PATH)
+
+
+def load_yolo():
+    if DETECTOR_BACKEND == "onnx":
+        from onnx_detector import OnnxDetector
+        prepare_yolo()
+        return OnnxDetector(YOLO_ONNX_PATH)
+    
+    from ultralytics import YOLO
+    return YOLO(YOLO_MODEL_PATH)
+
+
+def load_recognizer(model_dir, model_name, onnx_path):
+    # У режимі воркерів prefork.limit_threads виставляє ліміт потоків на процес
+    cpu_threads = int(os.getenv("OMP_NUM_THREADS", "8"))
+    if OCR_BACKEND == "onnx":
+        from onnx_recognizer import OnnxRecognizer
+        return OnnxRecognizer(onnx_path, model_dir)
+    
+    if OCR_BACKEND == "rec":
+        from paddleocr import TextRecognition
+        return TextRecognition(
+            model_name=model_name,
+            model_dir=model_dir,
+            cpu_threads=cpu_threads
+        )
+    
+    from paddleocr import PaddleOCR
+    return PaddleOCR(
+        text_recognition_model_name=model_name,
+        text_recognition_model_dir=model_dir,
+        text_recognition_batch_size=OCR_BATCH_SIZE,
+        cpu_threads=cpu_threads
+    )
+
+
+def load_ocr():
+    return load_recognizer(OCR_MODEL_DIR, OCR_MODEL_NAME, OCR_ONNX_PATH)
+
+
+def load_ocr_fast():
+    return load_recognizer(OCR_FAST_MODEL_DIR, OCR_FAST_MODEL_NAME, OCR_FAST_ONNX_PATH)
+
+
+# --- ДЕКОДУВАННЯ ---
+
+def decode_for_detection(contents):
+    """
+    Декодує завантаження для детекції.
+    Повертає (зображення, коефіцієнт зменшення) або (None, 1), якщо декодувати не вдалося.
+    Зменшення лише для JPEG, у якого воно майже безкоштовне; розміри — із заголовка.
+    Кадри для детекції плитками декодуються повністю.
+    """
+    buffer = np.frombuffer(contents, np.uint8)
+    header = image_header.sniff(contents)
+    if header is not None and header.format == "jpeg" and not needs_tiling((header.height, header.width)):
+        for factor, flag in REDUCED_DECODE_FLAGS:
+            if max(header.width, header.height) // factor >= DETECT_MIN_SIDE:
+                img = cv2.imdecode(buffer, flag)
+                if img is not None:
+                    return img, factor
+                break
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR), 1
+
+
+def decode_for_crops(contents):
+    """
+    Повне декодування в сірому для вирізання crop (вони однаково переводяться в сірий).
+    """
+    return cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_GRAYSCALE)
+
+
+def scale_bboxes(bboxes, factor, shape):
+    """
+    Переводить bbox зі зменшеного зображення в координати повного
+    (з охопленням усього зменшеного пікселя) та обрізає за межі кадру.
+    """
+    height, width = shape[:2]
+    return [
+        [min(x1 * factor, width), min(y1 * factor, height),
+         min(x2 * factor + factor - 1, width), min(y2 * factor + factor - 1, height)]
+        for x1, y1, x2, y2 in bboxes
+    ]
+
+
+# --- ДЕТЕКЦІЯ ---
+
+def yolo_predict_scored(model, images):
+    """
+    Один виклик YOLO над списком зображень.
+    Повертає для кожного зображення список (bbox [x1, y1, x2, y2], впевненість).
+    """
+    if DETECTOR_BACKEND == "onnx":
+        return [
+            list(zip(bboxes, scores))
+            for bboxes, scores in model.detect(images, conf=YOLO_CONF, iou=YOLO_IOU)
+        ]
+    
+    results = model(images, verbose=False, iou=YOLO_IOU, conf=YOLO_CONF)
+    return [
+        [(list(map(int, box.xyxy[0])), float(box.conf[0])) for box in result.boxes]
+        for result in results
+    ]
+
+
+def yolo_predict(model, images):
+    """
+    Один виклик YOLO над списком зображень.
+    Повертає для кожного зображення список bbox [x1, y1, x2, y2].
+    """
+    return [[bbox for bbox, _ in detections] for detections in yolo_predict_scored(model, images)]
+
+
+def needs_tiling(shape):
+    return TILING_MIN_SIDE > 0 and max(shape[:2]) >= TILING_MIN_SIDE
+
+
+def tile_offsets(length, size, overlap):
+    if length <= size:
+        return [0]
+    step = max(1, int(size * (1 - overlap)))
+    return list(range(0, length - size, step)) + [length - size]
+
+
+def merge_detections(bboxes, scores, threshold):
+    """
+    Жадібне злиття детекцій з різних плиток: від найвпевненішої, відкидаючи bbox,
+    що перекриваються з уже прийнятим більше ніж на threshold площі меншого з них.
+    На відміну від IoU, так прибирається й обрізаний межею плитки шматок номера.
+    """
+    if not bboxes:
+        return []
+    boxes = np.asarray(bboxes, dtype=np.float64)
+    areas = (boxes[:, 2] - boxes[:, 0]).clip(0) * (boxes[:, 3] - boxes[:, 1]).clip(0)
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    kept = []
+    while order.size:
+        best, rest = order[0], order[1:]
+        kept.append(best)
+        inter_w = (np.minimum(boxes[best, 2], boxes[rest, 2]) - np.maximum(boxes[best, 0], boxes[rest, 0])).clip(0)
+        inter_h = (np.minimum(boxes[best, 3], boxes[rest, 3]) - np.maximum(boxes[best, 1], boxes[rest, 1])).clip(0)
+        smaller = np.maximum(np.minimum(areas[best], areas[rest]), 1e-9)
+        order = rest[inter_w * inter_h / smaller <= threshold]
+    return [bboxes[i] for i in kept]
+
+
+def detect_tiled(model, img):
+    """
+    Детекція плитками з перекриттям одним батчем YOLO та злиттям між плитками.
+    Повертає (bbox у координатах кадру, кількість зображень у батчі).
+    """
+    height, width = img.shape[:2]
+    tiles = []
+    origins = []
+    for y in tile_offsets(height, TILE_SIZE, TILE_OVERLAP):
+        for x in tile_offsets(width, TILE_SIZE, TILE_OVERLAP):
+            tiles.append(img[y:y + TILE_SIZE, x:x + TILE_SIZE])
+            origins.append((x, y))
+    if TILE_FULL_FRAME:
+        tiles.append(img)
+        origins.append((0, 0))
+    
+    bboxes = []
+    scores = []
+    for (x, y), detections in zip(origins, yolo_predict_scored(model, tiles)):
+        for (x1, y1, x2, y2), score in detections:
+            bboxes.append([x1 + x, y1 + y, x2 + x, y2 + y])
+            scores.append(score)
+    return merge_detections(bboxes, scores, TILE_MERGE_THRESHOLD), len(tiles)
+
+
+def preprocess_plate_crops(img, bboxes, as_gray=False):
+    """
+    Вирізає та препроцесить crop кожного номера (сірий, CLAHE, висота входу розпізнавача).
+    img може бути кольоровим або вже сірим (decode_for_crops).
+    as_gray: повернути одноканальні crop (для бінарного формату).
+    """
+    return crop_preprocess.preprocess_crops(img, bboxes, as_gray=as_gray, shape=REC_IMAGE_SHAPE)
+
+
+# --- РОЗПІЗНАВАННЯ ---
+
+def extract_fragments(rec):
+    """
+    Витягує впевнені текстові фрагменти з результату PaddleOCR для одного зображення.
+    Повний конвеєр повертає списки rec_texts/rec_scores, розпізнавач — один rec_text/rec_score.
+    """
+    fragments = []
+    if 'rec_text' in rec:
+        texts = [rec['rec_text']]
+        scores = [rec.get('rec_score', 0.0)]
+    else:
+        texts = rec.get('rec_texts', [])
+        scores = rec.get('rec_scores', [])
+    for txt, score in zip(texts, scores):
+        if txt and score > 0.3:
+            fragments.append({"text": txt, "confidence": float(score)})
+    return fragments
+
+
+def ocr_predict(model, images):
+    """
+    OCR розпізнавання списку зображень одним батчем.
+    Повертає список фрагментів для кожного зображення.
+    """
+    if OCR_BACKEND in ("rec", "onnx"):
+        ocr_out = model.predict(images, batch_size=OCR_BATCH_SIZE)
+    else:
+        ocr_out = model.predict(images)
+    if not ocr_out or not isinstance(ocr_out, list):
+        return [[] for _ in images]
+    return [extract_fragments(rec) for rec in ocr_out]
+
+
+# --- ПОСТОБРОБКА ---
+
+# Стандартний номер: AA1234BB
+ALLOWED_LETTERS = 'ABCEHIKMOPTXDUY'
+STANDARD_PLATE_RE = re.compile(fr'^[{ALLOWED_LETTERS}]{{2}}\d{{4}}[{ALLOWED_LETTERS}]{{2}}$')
+
+
+def correct_plate_text(text):
+    text = text.replace(' ', '').replace('-', '').upper()
+    if not text or len(text) < 3:
+        return ""
+    chars = list(text)
+    if len(chars) == 8:
+        for i in [0, 1, 6, 7]:  # літери
+            if chars[i] == '0': chars[i] = 'O'
+            if chars[i] == '1': chars[i] = 'I'
+            if chars[i] == '8': chars[i] = 'B'
+        for i in range(2, 6):  # цифри
+            if chars[i] == 'O': chars[i] = '0'
+            if chars[i] == 'I': chars[i] = '1'
+            if chars[i] == 'B': chars[i] = '8'
+    text = ''.join(chars)
+    if STANDARD_PLATE_RE.match(text):
+        return text
+    return text if len(text) >= 5 else ""
+
+
+def is_standard_plate(text):
+    return bool(STANDARD_PLATE_RE.match(text))
+
+
+def is_confident_plate(fragments, min_confidence):
+    """
+    Чи можна довіряти результату швидкого розпізнавача: виправлений текст
+    відповідає формату AA1234BB і кожен фрагмент не менш упевнений за min_confidence.
+    """
+    if not fragments or min(f["confidence"] for f in fragments) < min_confidence:
+        return False
+    return is_standard_plate(correct_plate_text(" ".join(f["text"] for f in fragments)))
+
+
+def build_car_result(fragments, bbox):
+    """
+    Формує запис про номер з OCR фрагментів.
+    Повертає None, якщо текст не схожий на номер.
+    """
+    if not fragments:
+        return None
+    raw_text = " ".join(f["text"] for f in fragments)
+    confidence = sum(f["confidence"] for f in fragments) / len(fragments)
+    corrected = correct_plate_text(raw_text)
+    if not corrected or len(corrected) < 5:
+        return None
+    return {
+        "plate": corrected,
+        "raw_text": raw_text,
+        "confidence": round(confidence * 100, 1),
+        "bbox": bbox
+    }
+
+
+def assemble_cars(plate_crops, ocr_results):
+    """
+    Збирає відповідь /detect з результатів OCR у порядку bbox.
+    ocr_results: список (fragments, error) для кожного crop.
+    """
+    detected_cars = []
+    errors = []
+    for crop_data, (fragments, error) in zip(plate_crops, ocr_results):
+        if error:
+            errors.append({"bbox": crop_data["bbox"], "detail": error})
+            continue
+        car = build_car_result(fragments, crop_data["bbox"])
+        if car:
+            detected_cars.append(car)
+    return {"cars": detected_cars, "errors": errors}
@@ -0,0 +1,197 @@
+import os
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+import pipeline
+import crop_preprocess
+
+# Трекінг номерів між кадрами відео: OCR лише для найкращих crop кожного треку,
+# а прочитання з різних кадрів об'єднуються посимвольним голосуванням.
+
+# Мінімальний IoU для продовження треку; якщо IoU замалий, допускається зсув центру
+# не більше TRACK_MAX_SHIFT ширин bbox (швидкий рух між вибраними кадрами)
+TRACK_IOU_THRESHOLD = float(os.getenv("TRACK_IOU_THRESHOLD", "0.3"))
+TRACK_MAX_SHIFT = float(os.getenv("TRACK_MAX_SHIFT", "1.0"))
+# Скільки вибраних кадрів трек живе без детекцій
+TRACK_MAX_AGE = int(os.getenv("TRACK_MAX_AGE", "5"))
+# Повторний OCR треку: якщо якість crop зросла в TRACK_QUALITY_GAIN разів
+# або пройшло TRACK_OCR_EVERY кадрів треку (0 = лише за якістю); не більше TRACK_MAX_OCR разів
+TRACK_QUALITY_GAIN = float(os.getenv("TRACK_QUALITY_GAIN", "1.3"))
+TRACK_OCR_EVERY = int(os.getenv("TRACK_OCR_EVERY", "0"))
+TRACK_MAX_OCR = int(os.getenv("TRACK_MAX_OCR", "4"))
+
+
+def crop_quality(frame, bbox):
+    """
+    Якість crop для OCR: різкість (дисперсія Лапласіана) на масштабі розпізнавача,
+    зменшена для crop, нижчих за вхід моделі (їх доведеться збільшувати).
+    """
+    x1, y1, x2, y2 = bbox
+    crop = frame[y1:y2, x1:x2]
+    if crop.size == 0:
+        return 0.0
+    gray = crop if crop.ndim == 2 else cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    _, height, width = pipeline.REC_IMAGE_SHAPE
+    fitted = crop_preprocess.fit_height(gray, height, width)
+    sharpness = cv2.Laplacian(fitted, cv2.CV_32F).var()
+    return float(sharpness) * min(1.0, gray.shape[0] / height)
+
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def center_shift(a, b):
+    # Зсув центрів у ширинах попереднього bbox
+    dx = (a[0] + a[2] - b[0] - b[2]) / 2
+    dy = (a[1] + a[3] - b[1] - b[3]) / 2
+    return (dx * dx + dy * dy) ** 0.5 / max(1, a[2] - a[0])
+
+
+class Track:
+    def __init__(self, track_id, frame_index, bbox):
+        self.track_id = track_id
+        self.bbox = bbox
+        self.first_frame = frame_index
+        self.last_frame = frame_index
+        self.last_seen = 0
+        self.frames = 0
+        self.best_quality = 0.0
+        self.ocr_count = 0
+        # Голоси: довжина тексту -> позиція -> символ -> вага
+        self.votes = defaultdict(lambda: defaultdict(lambda: defaultdict(float)))
+        # Довжина тексту -> (сума впевненостей, кількість прочитань)
+        self.readings = defaultdict(lambda: [0.0, 0])
+
+    def add_reading(self, fragments, quality):
+        """
+        Голос прочитання: кожен символ виправленого тексту з вагою
+        впевненість фрагментів × якість crop.
+        """
+        if not fragments:
+            return
+        confidence = sum(f["confidence"] for f in fragments) / len(fragments)
+        text = pipeline.correct_plate_text(" ".join(f["text"] for f in fragments))
+        if not text:
+            return
+        weight = confidence * max(quality, 1e-6)
+        for position, char in enumerate(text):
+            self.votes[len(text)][position][char] += weight
+        self.readings[len(text)][0] += confidence
+        self.readings[len(text)][1] += 1
+
+    def result(self):
+        """
+        Підсумковий номер треку або None, якщо жодне прочитання не схоже на номер.
+        Перемагає довжина з найбільшою сумарною вагою, далі — символ з найбільшою вагою
+        на кожній позиції. Впевненість — середня частка ваги переможця на позиції,
+        помножена на середню впевненість OCR прочитань цієї довжини.
+        """
+        if not self.votes:
+            return None
+        length = max(self.votes, key=lambda n: sum(sum(c.values()) for c in self.votes[n].values()))
+        chars = []
+        agreement = []
+        for position in range(length):
+            counts = self.votes[length][position]
+            char, weight = max(counts.items(), key=lambda item: item[1])
+            chars.append(char)
+            agreement.append(weight / sum(counts.values()))
+        total_confidence, count = self.readings[length]
+        plate = "".join(chars)
+        if len(plate) < 5:
+            return None
+        return {
+            "track_id": self.track_id,
+            "plate": plate,
+            "confidence": round(float(np.mean(agreement)) * total_confidence / count * 100, 1),
+            "bbox": self.bbox,
+            "first_frame": self.first_frame,
+            "last_frame": self.last_frame,
+            "readings": sum(n for _, n in self.readings.values()),
+        }
+
+
+class PlateTracker:
+    """
+    Жадібний IoU трекер bbox номерів між вибраними кадрами.
+    Не потокобезпечний: один трекер на потік відео.
+    """
+
+    def __init__(self):
+        self._tracks = []
+        self._next_id = 1
+        # Лічильник оброблених кадрів для віку треків
+        self._tick = 0
+        self.stats = {"tracks": 0, "detections": 0, "ocr_crops": 0}
+
+    def update(self, frame_index, bboxes, qualities):
+        """
+        Зіставляє детекції кадру з треками.
+        Повертає для кожного bbox (трек, чи потрібен OCR цього crop).
+        """
+        self._tick += 1
+        self.stats["detections"] += len(bboxes)
+        candidates = []
+        for i, bbox in enumerate(bboxes):
+            for track in self._tracks:
+                overlap = iou(track.bbox, bbox)
+                if overlap >= TRACK_IOU_THRESHOLD or center_shift(track.bbox, bbox) <= TRACK_MAX_SHIFT:
+                    candidates.append((overlap, -center_shift(track.bbox, bbox), i, track))
+        candidates.sort(key=lambda item: (item[0], item[1]), reverse=True)
+
+        assigned = {}
+        used = set()
+        for _, _, i, track in candidates:
+            if i in assigned or id(track) in used:
+                continue
+            assigned[i] = track
+            used.add(id(track))
+
+        decisions = []
+        for i, (bbox, quality) in enumerate(zip(bboxes, qualities)):
+            track = assigned.get(i)
+            if track is None:
+                track = Track(self._next_id, frame_index, bbox)
+                self._next_id += 1
+                self._tracks.append(track)
+                self.stats["tracks"] += 1
+            track.bbox = bbox
+            track.last_frame = frame_index
+            track.last_seen = self._tick
+            track.frames += 1
+            needs_ocr = self._needs_ocr(track, quality)
+            if needs_ocr:
+                track.best_quality = max(track.best_quality, quality)
+                track.ocr_count += 1
+                self.stats["ocr_crops"] += 1
+            decisions.append((track, needs_ocr))
+        return decisions
+
+    def expire(self):
+        """
+        Закриває треки, не бачені більше TRACK_MAX_AGE оброблених кадрів.
+        Повертає їхні результати.
+        """
+        finished = [t for t in self._tracks if self._tick - t.last_seen > TRACK_MAX_AGE]
+        self._tracks = [t for t in self._tracks if self._tick - t.last_seen <= TRACK_MAX_AGE]
+        return [r for r in (t.result() for t in finished) if r]
+
+    def flush(self):
+        finished, self._tracks = self._tracks, []
+        return [r for r in (t.result() for t in finished) if r]
+
+    def _needs_ocr(self, track, quality):
+        if track.ocr_count == 0:
+            return True
+        if track.ocr_count >= TRACK_MAX_OCR:
+            return False
+        if quality >= track.best_quality * TRACK_QUALITY_GAIN:
+            return True
+        return TRACK_OCR_EVERY > 0 and track.frames - 1 >= TRACK_OCR_EVERY * track.ocr_count
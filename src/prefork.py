@@ -0,0 +1,162 @@
+import os
+import sys
+import signal
+import time
+import socket
+import traceback
+import uvicorn
+
+# Змінні середовища, якими бібліотеки (OpenMP, MKL, OpenBLAS) обмежують кількість потоків
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+# Воркер, що завершився швидше за PREFORK_MIN_UPTIME секунд, вважається таким, що впав на старті:
+# перезапуск з експоненційною затримкою до PREFORK_MAX_BACKOFF, після PREFORK_MAX_RESTARTS
+# таких падінь поспіль воркер більше не перезапускається
+PREFORK_MIN_UPTIME = float(os.getenv("PREFORK_MIN_UPTIME", "10"))
+PREFORK_MAX_BACKOFF = float(os.getenv("PREFORK_MAX_BACKOFF", "30"))
+PREFORK_MAX_RESTARTS = int(os.getenv("PREFORK_MAX_RESTARTS", "5"))
+
+
+def cpu_slices(workers):
+    """
+    Ділить доступні ядра на рівні неперетинні частини для кожного воркера.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    per_worker = max(1, len(cpus) // workers)
+    return [
+        cpus[(i * per_worker) % len(cpus):(i * per_worker) % len(cpus) + per_worker]
+        for i in range(workers)
+    ]
+
+
+def limit_threads(threads):
+    """
+    Обмежує intra-op потоки вже імпортованих бібліотек інференсу.
+    """
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    try:
+        import cv2
+        cv2.setNumThreads(threads)
+    except ImportError:
+        pass
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Можна викликати лише до першого паралельного виконання
+            pass
+
+
+def _run_worker(app, sock, index, cpus, threads, log_level):
+    # Дочірній процес ніколи не повертається в код супервізора (інакше він сам почне fork)
+    code = 1
+    try:
+        # Воркер успадковує обробники сигналів супервізора — повертаємо стандартні
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+        if cpus and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpus)
+        limit_threads(threads)
+        print(f"Воркер {index} (pid {os.getpid()}) на ядрах {cpus}, потоків: {threads}")
+
+        config = uvicorn.Config(app, log_level=log_level)
+        uvicorn.Server(config).run(sockets=[sock])
+        code = 0
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def serve(app, host, port, workers, preload=None, cpu_pinning=True, threads=None, log_level="info"):
+    """
+    Запускає кілька процесів uvicorn через fork від спільного батька.
+
+    preload() викликається в батьківському процесі один раз до fork:
+    ваги моделі, завантажені в ньому, діляться з воркерами через copy-on-write.
+    Усі воркери приймають з'єднання з одного сокета, тож ядро
+    розподіляє запити через спільну чергу accept.
+    """
+    slices = cpu_slices(workers)
+    if threads is None:
+        threads = len(slices[0])
+
+    # Ліміти потоків мають діяти ще до завантаження моделей у preload
+    limit_threads(threads)
+    if preload is not None:
+        preload()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    children = {}
+    started = {}
+    failures = {}
+    stopping = False
+
+    def spawn(index):
+        cpus = slices[index] if cpu_pinning else None
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(app, sock, index, cpus, threads, log_level)
+        children[pid] = index
+        started[index] = time.monotonic()
+
+    def wait_backoff(delay):
+        # Короткими кроками, щоб сигнал зупинки не чекав усю затримку
+        deadline = time.monotonic() + delay
+        while not stopping and time.monotonic() < deadline:
+            time.sleep(min(0.5, deadline - time.monotonic()))
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(workers):
+        spawn(index)
+    print(f"Запущено {workers} воркерів на {host}:{port}")
+
+    # Супервізор: перезапускає воркери, що впали, доки не прийде сигнал зупинки
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        
+        if time.monotonic() - started[index] < PREFORK_MIN_UPTIME:
+            failures[index] = failures.get(index, 0) + 1
+        else:
+            failures[index] = 0
+        if failures[index] > PREFORK_MAX_RESTARTS:
+            print(f"Воркер {index} падає на старті {failures[index]} разів поспіль, більше не перезапускається.")
+            continue
+        delay = min(PREFORK_MAX_BACKOFF, 2 ** (failures[index] - 1)) if failures[index] else 0
+        print(f"Воркер {index} (pid {pid}) завершився зі статусом {status}, перезапуск через {delay} с...")
+        wait_backoff(delay)
+        if not stopping:
+            spawn(index)
+
+    sock.close()
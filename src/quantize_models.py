@@ -0,0 +1,143 @@
+import os
+import sys
+import argparse
+import subprocess
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import pipeline
+from onnx_detector import ONNX_IMGSZ, export_onnx, letterbox
+from crop_preprocess import load_rec_config, to_batch
+
+# Статична INT8 квантизація детектора та розпізнавача для CPU.
+# Результат — окремі ONNX файли; сервіси завантажують їх за конфігом:
+#   yolo_server: DETECTOR_BACKEND=onnx YOLO_ONNX_PATH=<...>.int8.onnx
+#   ocr_server:  OCR_BACKEND=onnx OCR_ONNX_PATH=<...>.int8.onnx
+# Перед використанням перевірте точність: benchmarks/eval_quantized.py
+
+
+def int8_path(path):
+    base, ext = os.path.splitext(path)
+    return f"{base}.int8{ext}"
+
+
+def list_images(directory, limit):
+    files = sorted(p for p in Path(directory).glob('*.*') if p.suffix.lower() in ('.jpg', '.jpeg', '.png', '.bmp', '.webp'))
+    return files[:limit]
+
+
+def detector_samples(calib_dir, limit):
+    """
+    Калібрувальні входи детектора: фото з letterbox, як в OnnxDetector.
+    """
+    for path in list_images(calib_dir, limit):
+        img = cv2.imread(str(path))
+        if img is None:
+            continue
+        padded, _, _ = letterbox(img, ONNX_IMGSZ)
+        yield cv2.cvtColor(padded, cv2.COLOR_BGR2RGB).transpose(2, 0, 1)[None].astype(np.float32) / 255.0
+
+
+def recognizer_samples(calib_dir, limit, model_dir):
+    """
+    Калібрувальні входи розпізнавача: crop номерів з тим самим препроцесингом, що й у сервісі.
+    """
+    image_shape, _ = load_rec_config(model_dir)
+    for path in list_images(calib_dir, limit):
+        img = cv2.imread(str(path))
+        if img is None:
+            continue
+        crop, = pipeline.preprocess_plate_crops(img, [[0, 0, img.shape[1], img.shape[0]]])
+        yield to_batch([crop], image_shape)
+
+
+def paddle_to_onnx(model_dir, onnx_path):
+    """
+    Конвертує модель розпізнавання PaddlePaddle (inference.json + inference.pdiparams) в ONNX.
+    """
+    subprocess.run([
+        "paddle2onnx",
+        "--model_dir", model_dir,
+        "--model_filename", "inference.json",
+        "--params_filename", "inference.pdiparams",
+        "--save_file", onnx_path,
+        "--opset_version", "14",
+    ], check=True)
+
+
+def quantize(fp32_path, int8_output, samples, method, exclude):
+    from onnxruntime.quantization import (
+        CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quantize_static
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    class Reader(CalibrationDataReader):
+        def __init__(self, session_input):
+            self._input = session_input
+            self._samples = iter(samples)
+
+        def get_next(self):
+            sample = next(self._samples, None)
+            return None if sample is None else {self._input: sample}
+
+    import onnxruntime as ort
+    input_name = ort.InferenceSession(fp32_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    # Оптимізація та вивід форм перед квантизацією, як радить ONNX Runtime
+    prepared_path = f"{os.path.splitext(int8_output)[0]}.prep.onnx"
+    quant_pre_process(fp32_path, prepared_path)
+    try:
+        quantize_static(
+            prepared_path,
+            int8_output,
+            Reader(input_name),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            weight_type=QuantType.QInt8,
+            activation_type=QuantType.QUInt8,
+            calibrate_method={
+                "minmax": CalibrationMethod.MinMax,
+                "entropy": CalibrationMethod.Entropy,
+                "percentile": CalibrationMethod.Percentile,
+            }[method],
+            nodes_to_exclude=exclude,
+        )
+    finally:
+        os.remove(prepared_path)
+    print(f"INT8 модель збережено: {int8_output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Статична INT8 квантизація моделей для CPU")
+    parser.add_argument("model", choices=("detector", "recognizer"))
+    parser.add_argument("--calib-dir", required=True,
+                        help="Калібрувальний набір: фото авто (detector) або crop номерів (recognizer)")
+    parser.add_argument("--calib-count", type=int, default=200)
+    parser.add_argument("--fp32", help="ONNX модель FP32 (за замовчуванням з конфігу pipeline; створюється, якщо немає)")
+    parser.add_argument("--output", help="Куди зберегти INT8 модель (за замовчуванням <fp32>.int8.onnx)")
+    parser.add_argument("--method", choices=("minmax", "entropy", "percentile"), default="minmax")
+    parser.add_argument("--exclude", nargs="*", default=[], help="Вузли, що лишаються у FP32")
+    args = parser.parse_args()
+
+    if args.model == "detector":
+        fp32_path = args.fp32 or pipeline.YOLO_ONNX_PATH
+        if not os.path.exists(fp32_path):
+            export_onnx(pipeline.YOLO_MODEL_PATH, fp32_path)
+        samples = detector_samples(args.calib_dir, args.calib_count)
+    else:
+        fp32_path = args.fp32 or pipeline.OCR_ONNX_PATH
+        if not os.path.exists(fp32_path):
+            paddle_to_onnx(pipeline.OCR_MODEL_DIR, fp32_path)
+        samples = recognizer_samples(args.calib_dir, args.calib_count, pipeline.OCR_MODEL_DIR)
+
+    if not list_images(args.calib_dir, 1):
+        print(f"Не знайдено зображень у '{args.calib_dir}'")
+        sys.exit(2)
+
+    quantize(fp32_path, args.output or int8_path(fp32_path), samples, args.method, args.exclude)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import hashlib
+from collections import OrderedDict
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+def content_key(data):
+    """
+    Швидкий хеш вмісту завантаження: xxh3-128, якщо встановлено xxhash, інакше blake2b.
+    """
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class ResultCache:
+    """
+    LRU кеш результатів з TTL та лімітом пам'яті в байтах.
+    Розмір запису — довжина його JSON представлення.
+
+    disk_dir: необов'язковий другий рівень на диску, що переживає перезапуск.
+    Методи *_disk блокуючі — викликайте їх поза event loop.
+    """
+
+    def __init__(self, max_bytes, ttl, disk_dir=None):
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._stats = {"hits_memory": 0, "hits_disk": 0, "misses": 0, "evictions": 0}
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @property
+    def has_disk(self):
+        return bool(self._disk_dir)
+
+    def get(self, key):
+        """
+        Пошук у пам'яті. Повертає збережений результат або None.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, size, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        self._stats["hits_memory"] += 1
+        return value
+
+    def put(self, key, value, expires_at=None):
+        """
+        expires_at — час закінчення за time.monotonic() (за замовчуванням зараз + TTL),
+        щоб запис, піднятий з диска, не отримував новий повний TTL.
+        """
+        size = len(json.dumps(value, ensure_ascii=False))
+        if size > self._max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        if expires_at is None:
+            expires_at = time.monotonic() + self._ttl
+        self._entries[key] = (expires_at, size, value)
+        self._bytes += size
+
+        # Витіснення найдавніше використаних записів до ліміту пам'яті
+        while self._bytes > self._max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats["evictions"] += 1
+
+    def record_miss(self):
+        self._stats["misses"] += 1
+
+    def record_disk_hit(self):
+        self._stats["hits_disk"] += 1
+
+    def metrics(self):
+        lookups = self._stats["hits_memory"] + self._stats["hits_disk"] + self._stats["misses"]
+        hits = self._stats["hits_memory"] + self._stats["hits_disk"]
+        return {
+            **self._stats,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self._max_bytes,
+        }
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    # --- ДИСКОВИЙ РІВЕНЬ ---
+
+    def _disk_path(self, key):
+        return os.path.join(self._disk_dir, key[:2], f"{key}.json")
+
+    def get_disk(self, key):
+        """
+        Читає результат з диска, якщо файл є і TTL не минув.
+        Повертає (результат, expires_at для put) або None.
+        """
+        path = self._disk_path(key)
+        try:
+            remaining = os.path.getmtime(path) + self._ttl - time.time()
+            if remaining < 0:
+                os.remove(path)
+                return None
+            with open(path, encoding="utf-8") as f:
+                return json.load(f), time.monotonic() + remaining
+        except (OSError, ValueError):
+            return None
+
+    def put_disk(self, key, value):
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Запис через тимчасовий файл, щоб паралельне читання не бачило половину JSON
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Не вдалося записати кеш на диск: {e}")
+
+    def prune_disk(self):
+        """
+        Видаляє з диска записи з минулим TTL.
+        """
+        deadline = time.time() - self._ttl
+        removed = 0
+        for root, _, files in os.walk(self._disk_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < deadline:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
@@ -0,0 +1,58 @@
+import os
+import json
+
+import cv2
+import numpy as np
+
+# Зони інтересу (ROI) камер: детекція йде лише в описаному прямокутнику навколо
+# полігона, а bbox, центр яких поза полігоном, відкидаються.
+# Файл ROI_CONFIG_PATH — JSON {source_id: [[x, y], ...]} у пікселях оригінального кадру.
+ROI_CONFIG_PATH = os.getenv("ROI_CONFIG_PATH", "")
+
+
+def load_rois(path=ROI_CONFIG_PATH):
+    """
+    Читає полігони ROI з JSON. Повертає {source_id: масив точок (N, 2) float32}.
+    """
+    if not path:
+        return {}
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+
+    rois = {}
+    for source_id, points in config.items():
+        polygon = np.asarray(points, np.float32)
+        if polygon.ndim != 2 or polygon.shape[0] < 3 or polygon.shape[1] != 2:
+            raise ValueError(f"ROI '{source_id}': потрібно щонайменше 3 точки [x, y]")
+        rois[str(source_id)] = polygon
+    return rois
+
+
+def crop_to_roi(img, polygon, factor=1):
+    """
+    Вирізає з кадру (можливо, зменшеного в factor разів) прямокутник навколо полігона.
+    Повертає (view, (x_offset, y_offset)); view — зріз без копіювання.
+    """
+    h, w = img.shape[:2]
+    x, y, rect_w, rect_h = cv2.boundingRect(polygon / factor)
+    x1, y1 = min(max(0, x), w), min(max(0, y), h)
+    x2, y2 = min(w, x + rect_w), min(h, y + rect_h)
+    if x2 <= x1 or y2 <= y1:
+        # Полігон поза кадром (інша роздільна здатність камери): детекція по всьому кадру
+        return img, (0, 0)
+    return img[y1:y2, x1:x2], (x1, y1)
+
+
+def keep_in_roi(bboxes, polygon, offset, factor=1):
+    """
+    Переводить bbox зі зрізу в координати кадру і лишає ті, центр яких у полігоні.
+    """
+    x_offset, y_offset = offset
+    scaled = polygon / factor
+    kept = []
+    for x1, y1, x2, y2 in bboxes:
+        bbox = [x1 + x_offset, y1 + y_offset, x2 + x_offset, y2 + y_offset]
+        center = ((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2)
+        if cv2.pointPolygonTest(scaled, center, False) >= 0:
+            kept.append(bbox)
+    return kept
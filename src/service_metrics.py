@@ -0,0 +1,42 @@
+import threading
+from collections import deque
+
+
+class RollingStats:
+    """
+    Ковзне вікно останніх значень метрики (розмір батчу, затримка тощо).
+    Потокобезпечне, бо значення додаються і з event loop, і з потоків інференсу.
+    """
+
+    def __init__(self, window=2000):
+        self._values = deque(maxlen=window)
+        self._count = 0
+        self._total = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, value):
+        with self._lock:
+            self._values.append(value)
+            self._count += 1
+            self._total += value
+
+    def summary(self):
+        with self._lock:
+            values = sorted(self._values)
+            count = self._count
+            total = self._total
+
+        if not values:
+            return {"count": count}
+
+        def percentile(p):
+            return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+        return {
+            "count": count,
+            "mean": round(total / count, 3),
+            "p50": round(percentile(50), 3),
+            "p95": round(percentile(95), 3),
+            "p99": round(percentile(99), 3),
+            "max": round(values[-1], 3),
+        }
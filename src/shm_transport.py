@@ -0,0 +1,143 @@
+import os
+import re
+import sys
+import time
+import secrets
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+# Вирівнювання масивів усередині сегмента
+ALIGNMENT = 64
+
+# Усі сегменти сервісів мають цей префікс: ендпоінти відкривають лише такі імена,
+# а прибирання знаходить за ним сегменти, які ніхто не видалив
+SEGMENT_PREFIX = "plates_shm_"
+_SEGMENT_NAME_RE = re.compile(rf"^/?{SEGMENT_PREFIX}[0-9a-f]{{24}}$")
+SHM_DIR = "/dev/shm"
+
+# Ендпоінти спільної пам'яті приймають запити лише з loopback або Unix-сокета
+# (0 — для контейнерів на одному вузлі, що ходять через мережевий міст)
+SHM_LOOPBACK_ONLY = os.getenv("SHM_LOOPBACK_ONLY", "1") == "1"
+LOOPBACK_HOSTS = ("127.0.0.1", "::1", "localhost")
+
+
+def is_allowed_client(host):
+    """
+    Чи може клієнт з цією адресою (None для Unix-сокета) користуватись ендпоінтами спільної пам'яті.
+    """
+    return not SHM_LOOPBACK_ONLY or host is None or host in LOOPBACK_HOSTS
+
+
+def check_name(name):
+    if not isinstance(name, str) or not _SEGMENT_NAME_RE.match(name):
+        raise ValueError("Некоректне ім'я сегмента спільної пам'яті")
+
+
+def _untrack(shm):
+    """
+    Знімає сегмент з обліку resource_tracker цього процесу.
+    Інакше трекер видалить (або повідомить про "витік") сегмент при завершенні
+    процесу, хоча ним володіє інший сервіс.
+    """
+    if sys.version_info < (3, 13):
+        resource_tracker.unregister(shm._name, "shared_memory")
+
+
+def _create(size):
+    name = SEGMENT_PREFIX + secrets.token_hex(12)
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, create=True, size=max(1, size), track=False)
+    shm = shared_memory.SharedMemory(name=name, create=True, size=max(1, size))
+    _untrack(shm)
+    return shm
+
+
+def _open(name):
+    check_name(name)
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    _untrack(shm)
+    return shm
+
+
+def write_arrays(arrays):
+    """
+    Копіює список numpy масивів в один новий сегмент спільної пам'яті.
+    Повертає handle (ім'я сегмента, зсуви, форми, типи) для передачі іншому сервісу.
+    Сегмент не видаляється автоматично — власник має викликати release().
+    """
+    layout = []
+    offset = 0
+    for arr in arrays:
+        offset = (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        layout.append({"offset": offset, "shape": list(arr.shape), "dtype": str(arr.dtype)})
+        offset += arr.nbytes
+
+    shm = _create(offset)
+    try:
+        for arr, meta in zip(arrays, layout):
+            target = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf, offset=meta["offset"])
+            target[...] = arr
+            del target
+    finally:
+        shm.close()
+    return {"name": shm.name, "arrays": layout}
+
+
+def read_arrays(handle):
+    """
+    Читає масиви з сегмента за handle.
+    Повертає копії, щоб сегмент можна було одразу закрити
+    (моделі можуть тримати посилання на вхідні дані після інференсу).
+    """
+    shm = _open(handle["name"])
+    try:
+        arrays = []
+        for meta in handle["arrays"]:
+            view = np.ndarray(meta["shape"], dtype=meta["dtype"], buffer=shm.buf, offset=meta["offset"])
+            arrays.append(view.copy())
+            del view
+        return arrays
+    finally:
+        shm.close()
+
+
+def release(handle):
+    """
+    Видаляє сегмент. Викликає власник після завершення обробки запиту.
+    """
+    check_name(handle["name"])
+    try:
+        # Відкриваємо з обліком трекера: unlink() сам зніме сегмент з обліку
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=handle["name"], track=False)
+        else:
+            shm = shared_memory.SharedMemory(name=handle["name"])
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def prune(max_age):
+    """
+    Видаляє сегменти сервісів, старші за max_age секунд: ті, що лишились після тайм-аутів
+    (YOLO записав crop, а gateway вже не дочекався відповіді) або падіння процесів.
+    Повертає кількість видалених. Блокуючий — викликайте поза event loop.
+    """
+    if not os.path.isdir(SHM_DIR):
+        return 0
+    deadline = time.time() - max_age
+    removed = 0
+    for name in os.listdir(SHM_DIR):
+        if not _SEGMENT_NAME_RE.match(name):
+            continue
+        path = os.path.join(SHM_DIR, name)
+        try:
+            if os.path.getmtime(path) < deadline:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
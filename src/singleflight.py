@@ -0,0 +1,81 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Об'єднує однакові одночасні виклики: поки виконується робота для ключа,
+    усі інші запити з тим самим ключем чекають на її результат, а не запускають свою.
+
+    Робота виконується окремою задачею, тож відміна першого запиту
+    (наприклад, клієнт розірвав з'єднання) не зриває решту.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._stats = {"executions": 0, "coalesced": 0}
+
+    async def do(self, key, fn, *args):
+        """
+        Виконує await fn(*args) один раз на ключ серед одночасних викликів.
+        """
+        results = await self.do_batch([key], lambda _: self._single(fn, args))
+        return results[0]
+
+    async def do_batch(self, keys, fn):
+        """
+        Батч-варіант: fn(keys_to_run) отримує лише ключі, яких ще немає в роботі,
+        і повертає список результатів у тому ж порядку. Повторні ключі в самому
+        батчі теж об'єднуються. Повертає результати для всіх keys.
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        own = {}
+        for key in keys:
+            future = self._calls.get(key)
+            if future is None:
+                future = loop.create_future()
+                # Позначаємо помилку як отриману, навіть якщо всі очікувачі вже відмінені
+                future.add_done_callback(lambda f: f.cancelled() or f.exception())
+                self._calls[key] = future
+                own[key] = future
+                self._stats["executions"] += 1
+            else:
+                self._stats["coalesced"] += 1
+            futures.append(future)
+
+        if own:
+            own_keys = list(own)
+            task = asyncio.ensure_future(fn(own_keys))
+            task.add_done_callback(lambda t: self._finish(t, own_keys, own))
+
+        return await asyncio.gather(*(asyncio.shield(future) for future in futures))
+
+    def metrics(self):
+        return {**self._stats, "in_flight": len(self._calls)}
+
+    async def _single(self, fn, args):
+        return [await fn(*args)]
+
+    def _finish(self, task, keys, futures):
+        try:
+            if task.cancelled():
+                for key in keys:
+                    futures[key].cancel()
+                return
+            error = task.exception()
+            if error is None:
+                results = task.result()
+                if len(results) == len(keys):
+                    for key, result in zip(keys, results):
+                        futures[key].set_result(result)
+                    return
+                error = RuntimeError(f"Отримано {len(results)} результатів для {len(keys)} ключів")
+            for key in keys:
+                if not futures[key].done():
+                    futures[key].set_exception(error)
+        finally:
+            # Ключі звільняються за будь-якого результату, інакше наступні запити зависнуть
+            for key in keys:
+                self._calls.pop(key, None)
+                if not futures[key].done():
+                    futures[key].cancel()
@@ -0,0 +1,374 @@
+import os
+import sys
+import json
+import time
+import queue
+import asyncio
+import argparse
+import threading
+from urllib.parse import urlsplit
+
+import cv2
+
+import pipeline
+from plate_tracker import PlateTracker, crop_quality
+
+# Обробка відео (файл, RTSP, MJPEG по HTTP): кадри декодуються у фоновому потоці,
+# з них вибирається STREAM_SAMPLE_FPS кадрів на секунду, і вибрані кадри
+# батчами йдуть у детектор. Результат — потік подій по кадрах
+# або, з трекінгом, по авто (один підсумковий номер на трек).
+
+STREAM_SAMPLE_FPS = float(os.getenv("STREAM_SAMPLE_FPS", "2"))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "8"))
+# Скільки вибраних кадрів може чекати на детекцію
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "32"))
+
+# Які джерела приймає сервер. Мережеві — лише дозволені схеми на дозволених хостах
+# (обидва списки порожні за замовчуванням: інакше будь-який клієнт /detect_stream
+# міг би змусити gateway відкрити довільний URL, зокрема внутрішні сервіси).
+# Локальні файли — лише з STREAM_FILE_ROOT.
+STREAM_ALLOWED_SCHEMES = tuple(s for s in os.getenv("STREAM_ALLOWED_SCHEMES", "").split(",") if s)
+STREAM_ALLOWED_HOSTS = tuple(h.strip().lower() for h in os.getenv("STREAM_ALLOWED_HOSTS", "").split(",") if h.strip())
+STREAM_FILE_ROOT = os.getenv("STREAM_FILE_ROOT", "")
+
+LIVE_SCHEMES = ("rtsp://", "rtsps://", "rtmp://", "http://", "https://", "udp://", "tcp://")
+
+# Маркер кінця потоку в черзі кадрів
+_END = object()
+
+
+def is_live(source):
+    return source.startswith(LIVE_SCHEMES)
+
+
+def check_source(source):
+    """
+    Чи дозволено серверу відкривати це джерело.
+    Повертає None або текст помилки.
+    """
+    scheme = source.split("://", 1)[0] if "://" in source else ""
+    if scheme:
+        if scheme not in STREAM_ALLOWED_SCHEMES:
+            return f"Схема '{scheme}' не дозволена"
+        try:
+            host = (urlsplit(source).hostname or "").lower()
+        except ValueError:
+            return "Некоректний URL джерела"
+        if host not in STREAM_ALLOWED_HOSTS:
+            return f"Хост '{host}' не дозволений (STREAM_ALLOWED_HOSTS)"
+        return None
+    if not STREAM_FILE_ROOT:
+        return "Локальні файли вимкнено (STREAM_FILE_ROOT не задано)"
+    root = os.path.realpath(STREAM_FILE_ROOT)
+    path = os.path.realpath(os.path.join(root, source))
+    if os.path.commonpath([root, path]) != root:
+        return "Файл поза STREAM_FILE_ROOT"
+    return None
+
+
+def resolve_source(source):
+    if "://" in source or not STREAM_FILE_ROOT:
+        return source
+    return os.path.join(os.path.realpath(STREAM_FILE_ROOT), source)
+
+
+class FrameReader:
+    """
+    Фоновий потік, що читає кадри з cv2.VideoCapture і кладе вибрані в чергу.
+
+    Кадри між вибраними лише grab() (без retrieve і конвертації кольору).
+    Для файлів час кадру — з номера кадру та FPS файлу, черга блокує читання,
+    тож жоден вибраний кадр не губиться. Для живих потоків час — годинник,
+    а при повній черзі відкидається найстаріший кадр, щоб не відставати від камери.
+    """
+
+    def __init__(self, source, sample_fps=STREAM_SAMPLE_FPS, queue_size=STREAM_QUEUE_SIZE, max_frames=0):
+        self._source = source
+        self._live = is_live(source)
+        self._interval_ms = 1000.0 / sample_fps if sample_fps > 0 else 0.0
+        self._max_frames = max_frames
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stopping = threading.Event()
+        self._capture = None
+        self._thread = None
+        self.stats = {"frames_read": 0, "frames_sampled": 0, "frames_dropped": 0}
+
+    def start(self):
+        self._capture = cv2.VideoCapture(self._source)
+        if not self._capture.isOpened():
+            self._capture.release()
+            raise ValueError(f"Не вдалося відкрити джерело: {self._source}")
+        self._thread = threading.Thread(target=self._run, name="stream-reader", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def get(self, timeout=None):
+        """
+        Наступний вибраний кадр (index, timestamp_ms, frame) або None, якщо потік скінчився.
+        """
+        item = self._queue.get(timeout=timeout)
+        if item is _END:
+            # Лишаємо маркер для наступних викликів
+            self._queue.put(_END)
+            return None
+        return item
+
+    def get_nowait(self):
+        try:
+            return self.get(timeout=0)
+        except queue.Empty:
+            return False
+
+    def _run(self):
+        capture = self._capture
+        fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+        started = time.monotonic()
+        next_sample_ms = 0.0
+        index = -1
+        try:
+            while not self._stopping.is_set():
+                if not capture.grab():
+                    break
+                index += 1
+                self.stats["frames_read"] += 1
+                if self._live or fps <= 0:
+                    timestamp_ms = (time.monotonic() - started) * 1000.0
+                else:
+                    timestamp_ms = index * 1000.0 / fps
+                if timestamp_ms < next_sample_ms:
+                    continue
+                next_sample_ms = max(next_sample_ms + self._interval_ms, timestamp_ms)
+
+                ok, frame = capture.retrieve()
+                if not ok:
+                    continue
+                self.stats["frames_sampled"] += 1
+                self._put((index, round(timestamp_ms, 1), frame))
+                if self._max_frames and self.stats["frames_sampled"] >= self._max_frames:
+                    break
+        finally:
+            capture.release()
+            self._put_end()
+
+    def _put(self, item):
+        while not self._stopping.is_set():
+            try:
+                self._queue.put(item, timeout=0.5 if not self._live else 0)
+                return
+            except queue.Full:
+                if self._live:
+                    try:
+                        self._queue.get_nowait()
+                        self.stats["frames_dropped"] += 1
+                    except queue.Empty:
+                        pass
+
+    def _put_end(self):
+        while True:
+            try:
+                self._queue.put_nowait(_END)
+                return
+            except queue.Full:
+                # Споживач уже не читає — звільняємо місце для маркера
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+
+async def read_batch(reader, batch_size):
+    """
+    Чекає на перший кадр і добирає до batch_size тих, що вже в черзі.
+    Порожній список — кінець потоку.
+    """
+    first = await asyncio.to_thread(reader.get)
+    if first is None:
+        return []
+    batch = [first]
+    while len(batch) < batch_size:
+        item = reader.get_nowait()
+        if not item:
+            break
+        batch.append(item)
+    return batch
+
+
+async def stream_events(reader, detect_frames, batch_size=STREAM_BATCH_SIZE):
+    """
+    Асинхронний генератор подій для запущеного FrameReader.
+
+    detect_frames(frames) — корутина, що повертає для кожного кадру
+    результат у форматі /detect ({"cars", "errors"}).
+    Події: "plates" для кадрів з номерами або помилками, в кінці "end" зі статистикою.
+    """
+    started = time.perf_counter()
+    batches = 0
+    detect_ms = 0.0
+    try:
+        while True:
+            batch = await read_batch(reader, batch_size)
+            if not batch:
+                break
+            batch_started = time.perf_counter()
+            results = await detect_frames([frame for _, _, frame in batch])
+            detect_ms += (time.perf_counter() - batch_started) * 1000.0
+            batches += 1
+            for (index, timestamp_ms, _), result in zip(batch, results):
+                if result["cars"] or result["errors"]:
+                    yield {"event": "plates", "frame_index": index, "timestamp_ms": timestamp_ms, **result}
+    finally:
+        # stop() чекає завершення потоку читання: поза event loop
+        await asyncio.to_thread(reader.stop)
+
+    yield {
+        "event": "end",
+        **reader.stats,
+        "batches": batches,
+        "detect_ms": round(detect_ms, 1),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000.0, 1)
+    }
+
+
+def track_batch(_, tracker, batch, bboxes_list):
+    """
+    Оновлює трекер детекціями батчу кадрів (по порядку) і готує crop лише
+    для тих детекцій, яким потрібен OCR. Повертає (crops, [(трек, якість)]).
+    """
+    crops = []
+    owners = []
+    for (index, _, frame), bboxes in zip(batch, bboxes_list):
+        qualities = [crop_quality(frame, bbox) for bbox in bboxes]
+        selected = []
+        for bbox, quality, (track, needs_ocr) in zip(bboxes, qualities, tracker.update(index, bboxes, qualities)):
+            if needs_ocr:
+                selected.append(bbox)
+                owners.append((track, quality))
+        crops.extend(pipeline.preprocess_plate_crops(frame, selected))
+    return crops, owners
+
+
+async def stream_tracked_events(reader, detect_boxes, recognize, run_cpu, batch_size=STREAM_BATCH_SIZE):
+    """
+    Як stream_events, але з трекінгом: OCR лише для нових треків і помітно якісніших
+    crop, прочитання треку об'єднуються голосуванням (plate_tracker).
+    Події: "track" з підсумковим номером, коли трек закривається або потік скінчився,
+    "error" для кожного кадру батчу, обробка якого впала, в кінці "end".
+
+    detect_boxes(frames) — корутина, bbox для кожного кадру; recognize(crops) — фрагменти OCR
+    для кожного crop; run_cpu(fn, *args) — виконує fn(None, *args) поза event loop.
+    """
+    tracker = PlateTracker()
+    started = time.perf_counter()
+    batches = 0
+    try:
+        while True:
+            batch = await read_batch(reader, batch_size)
+            if not batch:
+                break
+            batches += 1
+            try:
+                bboxes_list = await detect_boxes([frame for _, _, frame in batch])
+                crops, owners = await run_cpu(track_batch, tracker, batch, bboxes_list)
+                batch_fragments = await recognize(crops) if crops else []
+            except Exception as e:
+                # Помилка батчу не обриває потік: кадри батчу позначаються помилкою
+                for index, timestamp_ms, _ in batch:
+                    yield {"event": "error", "frame_index": index, "timestamp_ms": timestamp_ms,
+                           "detail": f"Помилка обробки: {str(e)}"}
+                continue
+            for (track, quality), fragments in zip(owners, batch_fragments):
+                track.add_reading(fragments, quality)
+            for result in tracker.expire():
+                yield {"event": "track", **result}
+    finally:
+        # stop() чекає завершення потоку читання: поза event loop
+        await asyncio.to_thread(reader.stop)
+
+    for result in tracker.flush():
+        yield {"event": "track", **result}
+    yield {
+        "event": "end",
+        **reader.stats,
+        **tracker.stats,
+        "batches": batches,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000.0, 1)
+    }
+
+
+def preprocess_frame_crops(frames, bboxes_list):
+    """
+    Crop усіх кадрів батчу одним списком (у порядку кадрів і bbox).
+    """
+    crops = []
+    for frame, bboxes in zip(frames, bboxes_list):
+        crops.extend(pipeline.preprocess_plate_crops(frame, bboxes))
+    return crops
+
+
+def assemble_frames(bboxes_list, batch_fragments):
+    """
+    Розкладає результати OCR батчу назад по кадрах у формат /detect.
+    """
+    results = []
+    offset = 0
+    for bboxes in bboxes_list:
+        fragments = batch_fragments[offset:offset + len(bboxes)]
+        offset += len(bboxes)
+        plate_crops = [{"bbox": bbox} for bbox in bboxes]
+        results.append(pipeline.assemble_cars(plate_crops, [(f, None) for f in fragments]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Номери з відео або RTSP/MJPEG потоку (NDJSON у stdout)")
+    parser.add_argument("source", help="Відеофайл або URL потоку")
+    parser.add_argument("--fps", type=float, default=STREAM_SAMPLE_FPS, help="Кадрів на секунду для детекції")
+    parser.add_argument("--batch-size", type=int, default=STREAM_BATCH_SIZE)
+    parser.add_argument("--max-frames", type=int, default=0, help="Зупинитись після N вибраних кадрів")
+    parser.add_argument("--track", action="store_true", help="Трекінг: один OCR-результат на авто")
+    args = parser.parse_args()
+
+    print("Завантаження YOLO та OCR моделей...", file=sys.stderr)
+    yolo_model = pipeline.load_yolo()
+    ocr_model = pipeline.load_ocr()
+
+    def detect_batch(frames):
+        bboxes_list = pipeline.yolo_predict(yolo_model, frames)
+        crops = preprocess_frame_crops(frames, bboxes_list)
+        return assemble_frames(bboxes_list, pipeline.ocr_predict(ocr_model, crops) if crops else [])
+
+    async def detect_frames(frames):
+        return await asyncio.to_thread(detect_batch, frames)
+
+    async def detect_boxes(frames):
+        return await asyncio.to_thread(pipeline.yolo_predict, yolo_model, frames)
+
+    async def recognize(crops):
+        return await asyncio.to_thread(pipeline.ocr_predict, ocr_model, crops)
+
+    async def run_cpu(fn, *args):
+        return await asyncio.to_thread(fn, None, *args)
+
+    async def run():
+        reader = FrameReader(args.source, args.fps, max_frames=args.max_frames)
+        reader.start()
+        if args.track:
+            events = stream_tracked_events(reader, detect_boxes, recognize, run_cpu, args.batch_size)
+        else:
+            events = stream_events(reader, detect_frames, args.batch_size)
+        async for event in events:
+            print(json.dumps(event, ensure_ascii=False), flush=True)
+
+    try:
+        asyncio.run(run())
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
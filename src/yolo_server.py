@@ -1,34 +1,198 @@
+import os
+import time
 import uvicorn
 import cv2
-import numpy as np
 import base64
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from ultralytics import YOLO
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Body, Request
+from fastapi.responses import JSONResponse, Response
+
+from batching import MicroBatcher
+from inference_pool import InferencePool
+import prefork
+import shm_transport
+import crop_frame
+from pipeline import (
+    load_yolo, prepare_yolo, yolo_predict, preprocess_plate_crops, decode_for_detection, decode_for_crops,
+    scale_bboxes, needs_tiling, detect_tiled
+)
+from service_metrics import RollingStats
+from motion_gate import MotionGate, MOTION_GATE_ENABLED
+from roi_masks import load_rois
+import camera_detect
+
+# Мікробатчинг: скільки чекати на сусідні запити та максимальний розмір батчу
+YOLO_BATCH_WINDOW_MS = float(os.getenv("YOLO_BATCH_WINDOW_MS", "10"))
+YOLO_MAX_BATCH_SIZE = int(os.getenv("YOLO_MAX_BATCH_SIZE", "8"))
+
+# Кількість потоків інференсу (кожен з власною копією моделі) та потоків для кодування
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+CODEC_WORKERS = int(os.getenv("CODEC_WORKERS", "4"))
+
+# Режим кількох процесів: модель завантажується в батьківському процесі один раз,
+# воркери отримують її через fork (copy-on-write) і приймають запити з одного сокета
+WORKERS = int(os.getenv("WORKERS", "1"))
+PREFORK_PRELOAD = os.getenv("PREFORK_PRELOAD", "1") == "1"
+CPU_PINNING = os.getenv("CPU_PINNING", "1") == "1"
+# Потоків на воркер для intra-op паралелізму (0 = ядра воркера)
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "0"))
 
 # --- ГЛОБАЛЬНІ ЗМІННІ ---
-models = {}
+pools = {}
+preloaded = {}
+batchers = {}
+gates = {}
+# Полігони зон інтересу камер (source_id -> точки)
+rois = {}
+# Розмір відповіді /detect_plates (байти) для кожного формату crop
+payload_bytes = {"json": RollingStats(), "png": RollingStats(), "raw": RollingStats()}
+# Час декодування для детекції (мс) і скільки разом декодовано з кожним коефіцієнтом зменшення
+decode_ms = RollingStats()
+decode_factors = {}
+# Детекція плитками: час батчу плиток (мс) і кількість зображень у ньому
+tile_batch_ms = RollingStats()
+tiles_per_image = RollingStats()
+
+
+def decode_image(_, contents):
+    started = time.perf_counter()
+    img, factor = decode_for_detection(contents)
+    decode_ms.add((time.perf_counter() - started) * 1000.0)
+    decode_factors[factor] = decode_factors.get(factor, 0) + 1
+    return img, factor
+
+
+def decode_full(_, contents):
+    return decode_for_crops(contents)
+
+
+def extract_plate_crops(_, img, bboxes):
+    """
+    Вирізає, препроцесить і кодує в base64 crop кожного номера.
+    """
+    plate_crops = []
+    for bbox, crop_processed in zip(bboxes, preprocess_plate_crops(img, bboxes)):
+        # Кодування crop в base64
+        _, buffer = cv2.imencode('.jpg', crop_processed)
+        crop_base64 = base64.b64encode(buffer).decode('utf-8')
+        
+        plate_crops.append({
+            "bbox": bbox,
+            "image": crop_base64
+        })
+    return plate_crops
+
+
+def pack_plate_crops(_, img, bboxes, encoding):
+    """
+    Пакує сірі crop у бінарний кадр crop_frame (PNG або raw).
+    """
+    return crop_frame.pack(bboxes, preprocess_plate_crops(img, bboxes, as_gray=True), encoding)
+
+
+def read_shm_frame(_, handle):
+    img, = shm_transport.read_arrays(handle)
+    return img
+
+
+def write_shm_crops(_, img, bboxes):
+    """
+    Кладе препроцесовані crop у новий сегмент спільної пам'яті.
+    Сегментом далі володіє gateway: він видаляє його після OCR.
+    """
+    return shm_transport.write_arrays(preprocess_plate_crops(img, bboxes))
+
+
+def run_tiled(model, img):
+    started = time.perf_counter()
+    bboxes, tiles = detect_tiled(model, img)
+    tile_batch_ms.add((time.perf_counter() - started) * 1000.0)
+    tiles_per_image.add(tiles)
+    return bboxes
+
+
+async def detect(img):
+    """
+    Великі оглядові кадри — плитками одним батчем, решта — через мікробатчинг
+    разом з сусідніми запитами.
+    """
+    if needs_tiling(img.shape):
+        return await pools["yolo"].run(run_tiled, img)
+    return await batchers["yolo"].submit(img)
+
+
+async def detect_in_roi(img, factor, source_id):
+    """
+    Детекція в зоні інтересу камери з пропуском нерухомих кадрів (camera_detect).
+    Повертає bbox у координатах img.
+    """
+    return await camera_detect.detect_in_roi(
+        img, factor, source_id, detect, rois, gates.get("motion"), pools["codec"].run
+    )
+
+
+async def run_yolo_batch(images):
+    """
+    Запускає батч у пулі інференсу, не блокуючи event loop.
+    """
+    return await pools["yolo"].run(yolo_predict, images)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Завантаження YOLO моделі...")
+    pools["yolo"] = InferencePool(
+        load_yolo,
+        workers=INFERENCE_WORKERS,
+        name="yolo",
+        preloaded=preloaded.get("yolo")
+    )
+    pools["codec"] = InferencePool(workers=CODEC_WORKERS, name="codec")
     try:
-        models["yolo"] = YOLO('train_models/YOLO/my_YOLO_detection_car_plates.pt')
-        print("YOLO модель успішно завантажено.")
+        pools["yolo"].start()
+        print(f"YOLO модель успішно завантажено ({INFERENCE_WORKERS} потоків).")
     except Exception as e:
         print(f"Помилка завантаження YOLO: {e}")
     
+    # Одночасно може виконуватись стільки батчів, скільки потоків інференсу
+    batchers["yolo"] = MicroBatcher(
+        run_yolo_batch,
+        max_batch_size=YOLO_MAX_BATCH_SIZE,
+        window_ms=YOLO_BATCH_WINDOW_MS,
+        max_concurrent_batches=INFERENCE_WORKERS
+    )
+    await batchers["yolo"].start()
+    if MOTION_GATE_ENABLED:
+        gates["motion"] = MotionGate()
+    try:
+        rois.update(load_rois())
+        if rois:
+            print(f"Зони інтересу завантажено для {len(rois)} камер.")
+    except (OSError, ValueError) as e:
+        print(f"Помилка завантаження зон інтересу: {e}")
+    
     yield
     
-    models.clear()
+    gates.clear()
+    rois.clear()
+    
+    await batchers["yolo"].stop()
+    batchers.clear()
+    for pool in pools.values():
+        pool.shutdown()
+    pools.clear()
 
 app = FastAPI(lifespan=lifespan)
 
 @app.post("/detect_plates")
-async def detect_plates(file: UploadFile = File(...)):
+async def detect_plates(request: Request, file: UploadFile = File(...), source_id: str = Form(None)):
     """
     Детекція номерних знаків на зображенні.
     Повертає координати та crop зображення номерів.
+    source_id — ідентифікатор камери: зона інтересу (ROI_CONFIG_PATH)
+    і пропуск кадрів без руху.
+    Якщо Accept містить application/x-plate-crops — відповідь у бінарному
+    форматі crop_frame, інакше JSON з base64.
     """
     if not file.content_type or not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Файл має бути зображенням")
@@ -36,43 +200,110 @@ async def detect_plates(file: UploadFile = File(...)):
     try:
         # Читання файлу
         contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        img, factor = await pools["codec"].run(decode_image, contents)
         
         if img is None:
             raise HTTPException(status_code=400, detail="Не вдалося декодувати зображення")
         
         # YOLO детекція
-        results = models["yolo"](img, verbose=False, iou=0.5, conf=0.3)
+        bboxes = await detect_in_roi(img, factor, source_id)
+        
+        # Детекція йшла на зменшеному кадрі: crop беремо з повного, лише якщо є номери
+        if factor > 1 and bboxes:
+            img = await pools["codec"].run(decode_full, contents)
+            if img is None:
+                raise HTTPException(status_code=400, detail="Не вдалося декодувати зображення")
+            bboxes = scale_bboxes(bboxes, factor, img.shape)
+        
+        encoding = crop_frame.parse_accept(request.headers.get("accept"))
+        if encoding:
+            body = await pools["codec"].run(pack_plate_crops, img, bboxes, encoding)
+            payload_bytes[encoding].add(len(body))
+            return Response(content=body, media_type=crop_frame.CONTENT_TYPE)
         
-        plate_crops = []
-        for result in results:
-            for box in result.boxes:
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                crop = img[y1:y2, x1:x2]
-                
-                # Препроцесинг
-                gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
-                if gray.shape[0] < 80:
-                    gray = cv2.resize(gray, (gray.shape[1]*2, gray.shape[0]*2), 
-                                    interpolation=cv2.INTER_CUBIC)
-                clahe = cv2.createCLAHE(clipLimit=1.5, tileGridSize=(8, 8))
-                gray = clahe.apply(gray)
-                crop_processed = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
-                
-                # Кодування crop в base64
-                _, buffer = cv2.imencode('.jpg', crop_processed)
-                crop_base64 = base64.b64encode(buffer).decode('utf-8')
-                
-                plate_crops.append({
-                    "bbox": [x1, y1, x2, y2],
-                    "image": crop_base64
-                })
+        plate_crops = await pools["codec"].run(extract_plate_crops, img, bboxes)
         
-        return {"plate_crops": plate_crops}
+        response = JSONResponse({"plate_crops": plate_crops})
+        payload_bytes["json"].add(len(response.body))
+        return response
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Помилка YOLO: {str(e)}")
 
+
+
+@app.post("/detect_plates_shm")
+async def detect_plates_shm(request: Request, frame: dict = Body(...), source_id: str = Body(None), factor: int = Body(1)):
+    """
+    Детекція номерів для сервісів на тому ж вузлі.
+    Кадр уже декодований і лежить у спільній пам'яті (frame — handle сегмента),
+    crop повертаються так само через спільну пам'ять без JPEG і base64.
+    factor > 1 — кадр зменшений при декодуванні: повертаються лише bbox у його координатах,
+    crop з повної роздільності вирізає gateway.
+    Лише для клієнтів на цьому вузлі (SHM_LOOPBACK_ONLY) і сегментів сервісів.
+    """
+    if not shm_transport.is_allowed_client(request.client.host if request.client else None):
+        raise HTTPException(status_code=403, detail="Спільна пам'ять доступна лише локальним клієнтам")
+    try:
+        img = await pools["codec"].run(read_shm_frame, frame)
+    except FileNotFoundError:
+        # Сервіси не на одному вузлі: gateway перейде на HTTP
+        raise HTTPException(status_code=422, detail="Сегмент спільної пам'яті не знайдено")
+    except (ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Некоректний handle сегмента: {e}")
+    
+    try:
+        bboxes = await detect_in_roi(img, factor, source_id)
+        if factor > 1:
+            return {"plate_crops": [{"bbox": bbox} for bbox in bboxes], "crops": None}
+        crops = await pools["codec"].run(write_shm_crops, img, bboxes)
+        
+        return {
+            "plate_crops": [{"bbox": bbox} for bbox in bboxes],
+            "crops": crops
+        }
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Помилка YOLO: {str(e)}")
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Метрики мікробатчингу (розмір батчу, затримка в черзі), декодування,
+    детекції плитками, пропуску нерухомих кадрів і розмір відповіді для кожного формату crop.
+    """
+    return {
+        "batching": batchers["yolo"].metrics(),
+        "decode_ms": decode_ms.summary(),
+        "decode_factors": {str(factor): count for factor, count in sorted(decode_factors.items())},
+        "tile_batch_ms": tile_batch_ms.summary(),
+        "tiles_per_image": tiles_per_image.summary(),
+        "motion_gate": gates["motion"].metrics() if "motion" in gates else None,
+        "payload_bytes": {name: stats.summary() for name, stats in payload_bytes.items()}
+    }
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+def preload_model():
+    print("Попереднє завантаження моделі для воркерів...")
+    preloaded["yolo"] = load_yolo()
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    if WORKERS > 1:
+        # Без preload воркери завантажують модель самі: ONNX експортується заздалегідь, один раз
+        if not PREFORK_PRELOAD:
+            prepare_yolo()
+        prefork.serve(
+            app, "0.0.0.0", 8001, WORKERS,
+            preload=preload_model if PREFORK_PRELOAD else None,
+            cpu_pinning=CPU_PINNING,
+            threads=WORKER_THREADS or None
+        )
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8001)